@@ -4,21 +4,25 @@
 from trytond.pool import Pool
 
 from . import category, configuration, ir, product, uom
-from .product import price_digits, round_price
+from .product import price_digits, round_price, round_prices
 from .uom import uom_conversion_digits
 
-__all__ = [price_digits, round_price, uom_conversion_digits]
+__all__ = [price_digits, round_price, round_prices, uom_conversion_digits]
 
 
 def register():
     Pool.register(
         ir.Configuration,
+        ir.Sequence,
         uom.UomCategory,
+        uom.UomCategoryConversion,
         uom.Uom,
         category.Category,
+        category.CategoryClosure,
         product.Template,
         product.Product,
         product.ProductIdentifier,
+        product.ProductSearch,
         product.ProductListPrice,
         # before ProductCostPrice for migration
         product.ProductCostPriceMethod,
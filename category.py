@@ -1,10 +1,23 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
-from trytond.model import ModelSQL, ModelView, fields, tree
+from itertools import groupby
+from operator import itemgetter
+
+from sql import Literal, Null
+from sql.functions import CurrentTimestamp
+
+from trytond import backend
+from trytond.model import Index, ModelSQL, ModelView, fields, tree
+from trytond.model.modelstorage import is_leaf
+from trytond.pool import Pool
 from trytond.pyson import PYSONEncoder
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction
+
+_SEPARATOR = ' / '
 
 
-class Category(tree(separator=' / '), ModelSQL, ModelView):
+class Category(tree(separator=_SEPARATOR), ModelSQL, ModelView):
     "Product Category"
     __name__ = "product.category"
     name = fields.Char('Name', required=True, translate=True)
@@ -17,10 +30,14 @@ class Category(tree(separator=' / '), ModelSQL, ModelView):
     templates = fields.Many2Many(
         'product.template-product.category', 'category', 'template',
         "Products")
+    complete_name = fields.Char("Complete Name", readonly=True)
 
     @classmethod
     def __setup__(cls):
         super(Category, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.complete_name, Index.Similarity())))
         cls._order.insert(0, ('name', 'ASC'))
         cls._buttons.update({
                 'add_products': {
@@ -28,6 +45,148 @@ class Category(tree(separator=' / '), ModelSQL, ModelView):
                     },
                 })
 
+    @classmethod
+    def __register__(cls, module):
+        table = cls.__table__()
+        table_h = cls.__table_handler__(module)
+        fill_complete_name = not table_h.column_exist('complete_name')
+        super().__register__(module)
+        cursor = Transaction().connection.cursor()
+        update = Transaction().connection.cursor()
+
+        if fill_complete_name:
+            cursor.execute(*table.select(
+                    table.id, table.parent, table.name))
+            categories = {i: (p, n) for i, p, n in cursor}
+
+            def complete_name(id_):
+                parent, name = categories[id_]
+                if parent:
+                    return complete_name(parent) + _SEPARATOR + name
+                return name
+            for id_ in categories:
+                update.execute(*table.update(
+                        [table.complete_name], [complete_name(id_)],
+                        where=table.id == id_))
+
+    def get_rec_name(self, name):
+        pool = Pool()
+        Config = pool.get('ir.configuration')
+        # The complete name stores only the names in the default language
+        if (self.complete_name is not None
+                and Transaction().language == Config.get_language()):
+            return self.complete_name
+        return super().get_rec_name(name)
+
+    @classmethod
+    def search_rec_name(cls, name, clause):
+        pool = Pool()
+        Config = pool.get('ir.configuration')
+        _, operator, operand, *extra = clause
+        if (isinstance(operand, str)
+                and not operator.startswith('not ')
+                and operator != '!='
+                and Transaction().language == Config.get_language()):
+            operand = _SEPARATOR.join(
+                v.strip() for v in operand.split(_SEPARATOR))
+            return [('complete_name', operator, operand, *extra)]
+        return super().search_rec_name(name, clause)
+
+    @classmethod
+    def search_domain(cls, domain, active_test=True, tables=None):
+        domain = cls._search_domain_closure(domain)
+        return super().search_domain(
+            domain, active_test=active_test, tables=tables)
+
+    @classmethod
+    def _search_domain_closure(cls, domain):
+        "Convert the child_of and parent_of clauses to use the closure"
+        pool = Pool()
+        Closure = pool.get('product.category.closure')
+
+        def convert(domain):
+            if not is_leaf(domain):
+                return [
+                    convert(d) if isinstance(d, (list, tuple)) else d
+                    for d in domain]
+            if (len(domain) != 3
+                    or domain[0] != 'parent'
+                    or not domain[1].endswith(('child_of', 'parent_of'))
+                    or isinstance(domain[2], str)):
+                return domain
+            name, operator, value = domain
+            if not isinstance(value, (list, tuple)):
+                value = [value]
+            query = Closure.subtree_query(
+                [v for v in value if v is not None],
+                ancestors=operator.endswith('parent_of'))
+            if operator.startswith('not'):
+                return ('id', 'not in', query)
+            return ('id', 'in', query)
+        return convert(domain)
+
+    @classmethod
+    def create(cls, vlist):
+        pool = Pool()
+        Closure = pool.get('product.category.closure')
+        categories = super().create(vlist)
+        Closure.update(categories)
+        cls._update_complete_name(categories)
+        return categories
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Closure = pool.get('product.category.closure')
+        super().write(*args)
+        categories, to_rename = [], []
+        actions = iter(args)
+        for records, values in zip(actions, actions):
+            if 'parent' in values:
+                categories.extend(records)
+            if values.keys() & {'name', 'parent'}:
+                to_rename.extend(records)
+        if categories:
+            Closure.update(categories)
+        if to_rename:
+            cls._update_complete_name(to_rename)
+
+    @classmethod
+    def _update_complete_name(cls, categories):
+        "Store the complete name of the categories and their descendants"
+        pool = Pool()
+        Closure = pool.get('product.category.closure')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        ancestor = cls.__table__()
+        closure = Closure.__table__()
+
+        cursor.execute(*Closure.subtree_query(categories))
+        ids = [i for i, in cursor]
+        for sub_ids in grouped_slice(ids):
+            sub_ids = list(sub_ids)
+            cursor.execute(*closure.join(ancestor,
+                    condition=closure.ancestor == ancestor.id
+                    ).select(
+                    closure.descendant, ancestor.name,
+                    where=reduce_ids(closure.descendant, sub_ids),
+                    order_by=[closure.descendant, closure.depth.desc]))
+            for id_, names in groupby(cursor.fetchall(), key=itemgetter(0)):
+                cursor.execute(*table.update(
+                        [table.complete_name],
+                        [_SEPARATOR.join(n for _, n in names)],
+                        where=table.id == id_))
+
+        transaction.counter += 1
+        for category in categories:
+            category._local_cache.pop(category.id, None)
+        for cache in transaction.cache.values():
+            if cls.__name__ in cache:
+                cache_cls = cache[cls.__name__]
+                for id_ in ids:
+                    cache_cls.pop(id_, None)
+
     @classmethod
     @ModelView.button_action('product.act_category_product')
     def add_products(cls, categories):
@@ -36,3 +195,109 @@ class Category(tree(separator=' / '), ModelSQL, ModelView):
             'pyson_domain': PYSONEncoder().encode(
                 [('id', '=', categories[0].id)]),
              }
+
+
+class CategoryClosure(ModelSQL):
+    "Product Category Closure"
+    __name__ = 'product.category.closure'
+    ancestor = fields.Many2One(
+        'product.category', "Ancestor", required=True, ondelete='CASCADE')
+    descendant = fields.Many2One(
+        'product.category', "Descendant", required=True, ondelete='CASCADE')
+    depth = fields.Integer("Depth", required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(
+                    t,
+                    (t.ancestor, Index.Range()),
+                    (t.descendant, Index.Range())),
+                Index(
+                    t,
+                    (t.descendant, Index.Range()),
+                    (t.ancestor, Index.Range())),
+                })
+
+    @classmethod
+    def __register__(cls, module):
+        pool = Pool()
+        Category = pool.get('product.category')
+        category = Category.__table__()
+        cursor = Transaction().connection.cursor()
+        exist = backend.TableHandler.table_exist(cls._table)
+
+        super().__register__(module)
+
+        if not exist:
+            cursor.execute(*category.select(
+                    category.id, where=category.parent == Null))
+            cls.update([i for i, in cursor])
+
+    @classmethod
+    def subtree_query(cls, categories, ancestors=False):
+        "Return a query selecting the ids of the categories and descendants"
+        table = cls.__table__()
+        if ancestors:
+            return table.select(
+                table.ancestor,
+                where=reduce_ids(table.descendant, map(int, categories)))
+        else:
+            return table.select(
+                table.descendant,
+                where=reduce_ids(table.ancestor, map(int, categories)))
+
+    @classmethod
+    def update(cls, categories):
+        "Rebuild the closure of the categories and their descendants"
+        pool = Pool()
+        Category = pool.get('product.category')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        category = Category.__table__()
+
+        # Collect the subtrees of the categories from the parent column
+        parents = {}
+        level = list({int(c) for c in categories})
+        while level:
+            for sub_ids in grouped_slice(level):
+                cursor.execute(*category.select(
+                        category.id, category.parent,
+                        where=reduce_ids(category.id, sub_ids)))
+                parents.update(cursor)
+            children = []
+            for sub_ids in grouped_slice(level):
+                cursor.execute(*category.select(
+                        category.id,
+                        where=reduce_ids(category.parent, sub_ids)))
+                children.extend(i for i, in cursor if i not in parents)
+            level = children
+
+        for sub_ids in grouped_slice(list(parents)):
+            cursor.execute(*table.delete(
+                    where=reduce_ids(table.descendant, sub_ids)))
+
+        columns = [
+            table.ancestor, table.descendant, table.depth,
+            table.create_uid, table.create_date]
+        extra = [Literal(transaction.user), CurrentTimestamp()]
+        level = [i for i, p in parents.items() if p not in parents]
+        while level:
+            for sub_ids in grouped_slice(level):
+                sub_ids = list(sub_ids)
+                cursor.execute(*table.insert(columns,
+                        category.select(
+                            category.id, category.id, Literal(0), *extra,
+                            where=reduce_ids(category.id, sub_ids))))
+                cursor.execute(*table.insert(columns,
+                        category.join(table,
+                            condition=table.descendant == category.parent
+                            ).select(
+                            table.ancestor, category.id, table.depth + 1,
+                            *extra,
+                            where=reduce_ids(category.id, sub_ids))))
+            level = set(level)
+            level = [i for i, p in parents.items() if p in level]
@@ -1,6 +1,7 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 from trytond import backend
+from trytond.cache import Cache
 from trytond.model import (
     ModelSingleton, ModelSQL, ModelView, MultiValueMixin, ValueMixin, fields)
 from trytond.pool import Pool
@@ -37,12 +38,42 @@ class Configuration(ModelSingleton, ModelSQL, ModelView, MultiValueMixin):
             ('sequence_type', '=', Id('product', 'sequence_type_template')),
             ],
         help="Used to generate the first part of the product code.")
+    _sequences_cache = Cache('product.configuration.sequences')
 
     @classmethod
     def default_default_cost_price_method(cls, **pattern):
         return cls.multivalue_model(
             'default_cost_price_method').default_default_cost_price_method()
 
+    @classmethod
+    def get_sequences(cls):
+        "Return a dictionary with the ids of the code sequences"
+        sequences = cls._sequences_cache.get(None)
+        if sequences is None:
+            config = cls(1)
+            sequences = {}
+            for name in ['template_sequence', 'product_sequence']:
+                sequence = getattr(config, name)
+                sequences[name] = sequence.id if sequence else None
+            cls._sequences_cache.set(None, sequences)
+        return sequences
+
+    @classmethod
+    def create(cls, vlist):
+        records = super().create(vlist)
+        cls._sequences_cache.clear()
+        return records
+
+    @classmethod
+    def write(cls, *args):
+        super().write(*args)
+        cls._sequences_cache.clear()
+
+    @classmethod
+    def delete(cls, records):
+        super().delete(records)
+        cls._sequences_cache.clear()
+
 
 class ConfigurationDefaultCostPriceMethod(ModelSQL, ValueMixin):
     "Product Configuration Default Cost Price Method"
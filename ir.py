@@ -1,10 +1,13 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+from trytond import backend
 from trytond.config import config
 from trytond.model import fields
 from trytond.pool import PoolMeta
+from trytond.transaction import Transaction, without_check_access
 
 price_decimal = config.getint('product', 'price_decimal', default=4)
+sql_sequence = backend.Database.has_sequence()
 
 
 class Configuration(metaclass=PoolMeta):
@@ -22,3 +25,38 @@ class Configuration(metaclass=PoolMeta):
                 "The price_decimal %s in [product] configuration section "
                 "is different from the value %s in 'ir.configuration'." % (
                     price_decimal, self.product_price_decimal))
+
+
+class Sequence(metaclass=PoolMeta):
+    __name__ = 'ir.sequence'
+
+    @without_check_access
+    def get_many(self, count):
+        "Return the count next sequence values"
+        cls = self.__class__
+        sequence = cls(self.id)
+        if sequence.type != 'incremental':
+            return [sequence.get() for _ in range(count)]
+        elif not count:
+            return []
+        transaction = Transaction()
+        increment = sequence.number_increment
+        if sql_sequence and not cls._strict:
+            cursor = transaction.connection.cursor()
+            cursor.execute(
+                'SELECT nextval(\'"%s"\') FROM generate_series(1, %%s)'
+                % sequence._sql_sequence_name, (count,))
+            numbers = [n for n, in cursor]
+        else:
+            number_next = sequence.number_next_internal
+            cls.write([sequence], {
+                    'number_next_internal': (
+                        number_next + count * increment),
+                    })
+            numbers = range(
+                number_next, number_next + count * increment, increment)
+        date = transaction.context.get('date')
+        prefix = cls._process(sequence.prefix, date=date)
+        suffix = cls._process(sequence.suffix, date=date)
+        return ['%s%0*d%s' % (prefix, sequence.padding, n, suffix)
+            for n in numbers]
@@ -2,33 +2,52 @@
 # this repository contains the full copyright notices and license terms.
 import copy
 import logging
+import multiprocessing
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from decimal import Decimal
+from functools import lru_cache
 from importlib import import_module
+from itertools import islice
+from weakref import WeakKeyDictionary
 
 import stdnum
 import stdnum.exceptions
+import stdnum.util
 from sql import Column, Literal, Null
-from sql.functions import CharLength
-from sql.operators import Equal
+from sql.aggregate import Count, Min
+from sql.conditionals import Case, Coalesce, NullIf
+from sql.functions import Abs, CharLength, CurrentTimestamp, Floor, Mod, Round
+from sql.operators import Concat, Equal
 
 from trytond import backend
+from trytond.config import config
 from trytond.i18n import gettext
 from trytond.model import (
-    DeactivableMixin, Exclude, Index, Model, ModelSQL, ModelView, UnionMixin,
-    fields, sequence_ordered)
+    DeactivableMixin, Exclude, Index, ModelSQL, ModelView, UnionMixin, fields,
+    sequence_ordered)
+from trytond.model.exceptions import SQLConstraintError
+from trytond.model.modelstorage import is_leaf
+from trytond.model.multivalue import filter_pattern
 from trytond.modules.company.model import (
     CompanyMultiValueMixin, CompanyValueMixin)
 from trytond.pool import Pool
 from trytond.pyson import Eval, Get, If
-from trytond.tools import is_full_text, lstrip_wildcard
+from trytond.tools import (
+    grouped_slice, is_full_text, lstrip_wildcard, reduce_ids)
 from trytond.tools.multivalue import migrate_property
-from trytond.transaction import Transaction
+from trytond.transaction import Transaction, without_check_access
 
 from .exceptions import InvalidIdentifierCode
 from .ir import price_decimal
 
-__all__ = ['price_digits', 'round_price', 'TemplateFunction']
+__all__ = ['price_digits', 'round_price', 'round_prices', 'TemplateFunction']
 logger = logging.getLogger(__name__)
+_subquery_threshold = config.getint('database', 'subquery_threshold')
+_validation_chunk_size = 10000
+# The first identifiers of the variants per transaction
+_identifiers_get_cache = WeakKeyDictionary()
 
 TYPES = [
     ('goods', 'Goods'),
@@ -43,12 +62,77 @@ COST_PRICE_METHODS = [
 price_digits = (16, price_decimal)
 
 
+_price_quantum = Decimal(1) / 10 ** price_digits[1]
+
+
 def round_price(value, rounding=None):
     "Round price using the price digits"
     if isinstance(value, int):
         return Decimal(value)
-    return value.quantize(
-        Decimal(1) / 10 ** price_digits[1], rounding=rounding)
+    return value.quantize(_price_quantum, rounding=rounding)
+
+
+def round_prices(values, rounding=None):
+    "Round the iterable of prices using the price digits"
+    quantum = _price_quantum
+    return [Decimal(v) if isinstance(v, int)
+        else v.quantize(quantum, rounding=rounding) for v in values]
+
+
+def _round_price_sql(expression):
+    "Return SQL expression rounding like round_price"
+    digits = price_digits[1]
+    scaled = expression * 10 ** digits
+    floor = Floor(scaled)
+    # Round half to even like the default context of decimal
+    return Case(
+        (scaled - floor == Literal(Decimal('0.5')),
+            (floor + Mod(Abs(floor), 2)) / 10 ** digits),
+        else_=Round(expression, digits))
+
+
+@classmethod
+def get_multivalues(cls, records, name, **pattern):
+    "Return the values of the multivalue field for the records by id"
+    Value = cls.multivalue_model(name)
+    transaction = Transaction()
+    cursor = transaction.connection.cursor()
+    table = Value.__table__()
+
+    if issubclass(Value, CompanyValueMixin):
+        pattern.setdefault('company', transaction.context.get('company'))
+    pattern = filter_pattern(pattern, Value)
+    parent, = (f for f, field in Value._fields.items()
+        if field._type == 'many2one' and field.model_name == cls.__name__)
+    parent = Column(table, parent)
+
+    where = Literal(True)
+    order_by = []
+    for fname, value in pattern.items():
+        column = Column(table, fname)
+        if value is None:
+            where &= column == Null
+        else:
+            value = Value._fields[fname].sql_format(value)
+            where &= (column == value) | (column == Null)
+            # Give priority to the values matching the pattern
+            order_by.append(Case((column == Null, 1), else_=0))
+    order_by.append(table.id)
+
+    values = {}
+    ids = list({int(r) for r in records})
+    for sub_ids in grouped_slice(ids):
+        cursor.execute(*table.select(parent, Column(table, name),
+                where=reduce_ids(parent, sub_ids) & where,
+                order_by=order_by))
+        for id_, value in cursor:
+            values.setdefault(id_, value)
+
+    default = getattr(cls, 'default_%s' % name, None)
+    for id_ in ids:
+        if id_ not in values:
+            values[id_] = default(**pattern) if default else None
+    return values
 
 
 class Template(
@@ -90,6 +174,7 @@ class Template(
             help="The method used to calculate the cost price."))
     cost_price_methods = fields.One2Many(
         'product.cost_price_method', 'template', "Cost Price Methods")
+    get_multivalues = get_multivalues
     default_uom = fields.Many2One('product.uom', "Default UOM", required=True,
         help="The standard unit of measure for the product.\n"
         "Used internally when calculating the stock levels of goods "
@@ -184,6 +269,18 @@ class Template(
         code_value = operand
         if operator.endswith('like') and is_full_text(operand):
             code_value = lstrip_wildcard(operand)
+        if bool_op == 'OR':
+            # Use the search tokens of the variants
+            return [bool_op,
+                ('name', operator, operand, *extra),
+                ('code', operator, code_value, *extra),
+                ('products', 'where', [
+                        ('search_tokens', 'where', [
+                                ('type', '=', 'code'),
+                                ('token', operator, code_value, *extra),
+                                ]),
+                        ]),
+                ]
         return [bool_op,
             ('name', operator, operand, *extra),
             ('code', operator, code_value, *extra),
@@ -199,10 +296,32 @@ class Template(
     def default_consumable():
         return False
 
-    def get_cost_price(self, name):
-        if len(self.products) == 1:
-            product, = self.products
-            return product.cost_price
+    @classmethod
+    def get_cost_price(cls, templates, name):
+        pool = Pool()
+        Product = pool.get('product.product')
+        product = Product.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        where = Literal(True)
+        if transaction.context.get('active_test', True):
+            where &= product.active == Literal(True)
+        template2product = {}
+        for sub_templates in grouped_slice(templates):
+            cursor.execute(*product.select(
+                    product.template, Min(product.id),
+                    where=reduce_ids(
+                        product.template, map(int, sub_templates))
+                    & where,
+                    group_by=product.template,
+                    having=Count(product.id) == 1))
+            template2product.update(cursor)
+        cost_prices = Product.get_multivalues(
+            template2product.values(), 'cost_price')
+        return {
+            t.id: cost_prices.get(template2product.get(t.id))
+            for t in templates}
 
     @classmethod
     def default_cost_price_method(cls, **pattern):
@@ -223,11 +342,12 @@ class Template(
     def default_code_readonly(cls):
         pool = Pool()
         Configuration = pool.get('product.configuration')
-        config = Configuration(1)
-        return bool(config.template_sequence)
+        return bool(Configuration.get_sequences()['template_sequence'])
 
-    def get_code_readonly(self, name):
-        return self.default_code_readonly()
+    @classmethod
+    def get_code_readonly(cls, records, name):
+        code_readonly = cls.default_code_readonly()
+        return {r.id: code_readonly for r in records}
 
     @fields.depends('type', 'cost_price_method')
     def on_change_type(self):
@@ -251,12 +371,17 @@ class Template(
 
     @classmethod
     def _new_code(cls):
+        return cls._new_codes(1)[0]
+
+    @classmethod
+    def _new_codes(cls, count):
         pool = Pool()
         Configuration = pool.get('product.configuration')
-        config = Configuration(1)
-        sequence = config.template_sequence
+        Sequence = pool.get('ir.sequence')
+        sequence = Configuration.get_sequences()['template_sequence']
         if sequence:
-            return sequence.get()
+            return Sequence(sequence).get_many(count)
+        return [None] * count
 
     @classmethod
     def create(cls, vlist):
@@ -265,10 +390,14 @@ class Template(
         vlist = [v.copy() for v in vlist]
         for values in vlist:
             values.setdefault('products', None)
-            if not values.get('code'):
-                values['code'] = cls._new_code()
+        missing = [v for v in vlist if not v.get('code')]
+        if len(missing) == 1:
+            missing[0]['code'] = cls._new_code()
+        elif missing:
+            for values, code in zip(missing, cls._new_codes(len(missing))):
+                values['code'] = code
         templates = super(Template, cls).create(vlist)
-        products = sum((t.products for t in templates), ())
+        products = [p for t in templates for p in t.products]
         Product.sync_code(products)
         return templates
 
@@ -276,10 +405,20 @@ class Template(
     def write(cls, *args):
         pool = Pool()
         Product = pool.get('product.product')
+        Search = pool.get('product.product.search')
         super().write(*args)
-        templates = sum(args[0:None:2], [])
-        products = sum((t.products for t in templates), ())
-        Product.sync_code(products)
+        templates, to_update = [], []
+        actions = iter(args)
+        for records, values in zip(actions, actions):
+            if 'code' in values:
+                templates.extend(records)
+            if values.keys() & {'name', 'code'}:
+                to_update.extend(records)
+        if templates:
+            products = [p for t in templates for p in t.products]
+            Product.sync_code(products)
+        if to_update:
+            Search.update_templates(to_update)
 
     @classmethod
     def copy(cls, templates, default=None):
@@ -290,6 +429,56 @@ class Template(
         default.setdefault('code', None)
         return super().copy(templates, default=default)
 
+    @classmethod
+    def import_catalog(
+            cls, vlist, chunk_size=1000, commit=False, processes=None):
+        """Create the templates from the iterable of values by chunks
+
+        The values are the same as for create so they may contain the
+        products to create with their identifiers.
+        The codes of the identifiers are checked for each chunk before
+        creating it, using processes or the identifier_validation_processes
+        configuration.
+        If commit is set, the transaction is committed after each chunk.
+        Return the number of templates created.
+        """
+        pool = Pool()
+        Identifier = pool.get('product.identifier')
+        transaction = Transaction()
+        if processes is None:
+            processes = config.getint(
+                'product', 'identifier_validation_processes', default=0)
+        count = 0
+        start = time.perf_counter()
+        vlist = iter(vlist)
+        for sub_vlist in iter(lambda: list(islice(vlist, chunk_size)), []):
+            Identifier.validate_codes([
+                    Identifier(type=v.get('type'), code=v.get('code'))
+                    for v in cls._import_catalog_identifiers(sub_vlist)],
+                processes=processes)
+            with transaction.set_context(_check_identifier_code=False):
+                count += len(cls.create(sub_vlist))
+            if commit:
+                transaction.commit()
+            duration = time.perf_counter() - start
+            logger.info(
+                "imported %d templates in %.2fs (%.0f/s)",
+                count, duration, count / duration if duration else 0)
+        return count
+
+    @classmethod
+    def _import_catalog_identifiers(cls, vlist):
+        "Yield the values of the identifiers to create with the templates"
+        for values in vlist:
+            for action, *args in values.get('products', []):
+                if action != 'create':
+                    continue
+                for product_values in args[0]:
+                    for action, *args in product_values.get(
+                            'identifiers', []):
+                        if action == 'create':
+                            yield from args[0]
+
     @classmethod
     def search_global(cls, text):
         for record, rec_name, icon in super(Template, cls).search_global(text):
@@ -371,6 +560,8 @@ class Product(
     identifiers = fields.One2Many(
         'product.identifier', 'product', "Identifiers",
         help="Other identifiers associated with the variant.")
+    search_tokens = fields.One2Many(
+        'product.product.search', 'product', "Search Tokens", readonly=True)
     cost_price = fields.MultiValue(fields.Numeric(
             "Cost Price", digits=price_digits,
             states={
@@ -380,6 +571,7 @@ class Product(
             "or carry out the service."))
     cost_prices = fields.One2Many(
         'product.cost_price', 'product', "Cost Prices")
+    get_multivalues = get_multivalues
     description = fields.Text("Description", translate=True)
     list_price_uom = fields.Function(fields.Numeric('List Price',
         digits=price_digits), 'get_price_uom')
@@ -489,18 +681,28 @@ class Product(
                     value = None
                 setattr(self, name, value)
 
-    def get_template(self, name):
-        value = getattr(self.template, name)
-        if isinstance(value, Model):
-            field = getattr(self.__class__, name)
-            if field._type == 'reference':
-                return str(value)
-            return value.id
-        elif (isinstance(value, (list, tuple))
-                and value and isinstance(value[0], Model)):
-            return [r.id for r in value]
-        else:
-            return value
+    @classmethod
+    def get_template(cls, products, names):
+        pool = Pool()
+        Template = pool.get('product.template')
+        template_ids = {p.id: p.template.id if p.template else None
+            for p in products}
+        with without_check_access():
+            templates = {t['id']: t for t in Template.read(
+                    list(filter(None, set(template_ids.values()))), names)}
+        result = {}
+        for name in names:
+            field = getattr(cls, name)
+            values = result[name] = {}
+            for product_id, template_id in template_ids.items():
+                if template_id is None:
+                    value = None
+                else:
+                    value = templates[template_id][name]
+                    if field._type in {'one2many', 'many2many'}:
+                        value = list(value or [])
+                values[product_id] = value
+        return result
 
     @fields.depends('template', '_parent_template.code')
     def on_change_with_prefix_code(self, name=None):
@@ -531,6 +733,62 @@ class Product(
     def search_template(cls, name, clause):
         return [('template.' + clause[0],) + tuple(clause[1:])]
 
+    @classmethod
+    def search_domain(cls, domain, active_test=True, tables=None):
+        domain = cls._search_domain_template(domain)
+        return super().search_domain(
+            domain, active_test=active_test, tables=tables)
+
+    @classmethod
+    def _search_domain_template(cls, domain):
+        "Merge the template clauses of each level of domain into one"
+        pool = Pool()
+        Rule = pool.get('ir.rule')
+        Template = pool.get('product.template')
+
+        if (Template.estimated_count() >= _subquery_threshold
+                and not Rule.domain_get(Template.__name__, mode='read')):
+            # The template table is already joined once for all the clauses
+            return domain
+
+        def template_clause(clause):
+            field = cls._fields.get(clause[0].split('.', 1)[0])
+            if isinstance(field, TemplateFunction):
+                domain = getattr(cls, field.searcher)(field.name, clause)
+                if (len(domain) == 1 and is_leaf(domain[0])
+                        and domain[0][0].startswith('template.')):
+                    name, *clause = domain[0]
+                    return (name[len('template.'):], *clause)
+
+        def merge(domain):
+            if is_leaf(domain) or not domain:
+                return domain
+            if domain[0] in ['AND', 'OR']:
+                operator, domain = domain[0], domain[1:]
+            else:
+                operator = None
+            result, templates = [], []
+            for clause in domain:
+                if is_leaf(clause):
+                    tclause = template_clause(clause)
+                    if tclause:
+                        templates.append((clause, tclause))
+                    else:
+                        result.append(clause)
+                else:
+                    result.append(merge(clause))
+            if len(templates) > 1:
+                clauses = [c for _, c in templates]
+                if operator:
+                    clauses.insert(0, operator)
+                result.append(('template', 'where', clauses))
+            else:
+                result.extend(c for c, _ in templates)
+            if operator:
+                result.insert(0, operator)
+            return result
+        return merge(domain)
+
     @classmethod
     def order_rec_name(cls, tables):
         pool = Pool()
@@ -554,6 +812,8 @@ class Product(
 
     @classmethod
     def search_rec_name(cls, name, clause):
+        pool = Pool()
+        Config = pool.get('ir.configuration')
         _, operator, operand, *extra = clause
         if operator.startswith('!') or operator.startswith('not '):
             bool_op = 'AND'
@@ -562,6 +822,18 @@ class Product(
         code_value = operand
         if operator.endswith('like') and is_full_text(operand):
             code_value = lstrip_wildcard(operand)
+        if (bool_op == 'OR'
+                and Transaction().language == Config.get_language()):
+            # The search tokens store only the name in the default language
+            if code_value == operand:
+                return [('search_tokens.token', operator, operand, *extra)]
+            return [('search_tokens', 'where', ['OR', [
+                            ('type', '=', 'name'),
+                            ('token', operator, operand, *extra),
+                            ], [
+                            ('type', '=', 'code'),
+                            ('token', operator, code_value, *extra),
+                            ]])]
         return [bool_op,
             ('code', operator, code_value, *extra),
             ('identifiers.code', operator, code_value, *extra),
@@ -569,22 +841,34 @@ class Product(
             ('template.code', operator, code_value, *extra),
             ]
 
-    @staticmethod
-    def get_price_uom(products, name):
-        Uom = Pool().get('product.uom')
-        res = {}
+    @classmethod
+    def get_price_uom(cls, products, name):
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        Template = pool.get('product.template')
         field = name[:-4]
         if Transaction().context.get('uom'):
             to_uom = Uom(Transaction().context['uom'])
         else:
             to_uom = None
+        if field == 'list_price':
+            prices = Template.get_multivalues(
+                {p.template for p in products}, field)
+            res = {p.id: prices[p.template.id] for p in products}
+        elif field == 'cost_price':
+            res = cls.get_multivalues(products, field)
+        else:
+            res = {p.id: getattr(p, field) for p in products}
+        to_convert = []
         for product in products:
-            price = getattr(product, field)
             if to_uom and product.default_uom.category == to_uom.category:
-                res[product.id] = Uom.compute_price(
-                    product.default_uom, price, to_uom)
-            else:
-                res[product.id] = price
+                to_convert.append(product)
+        if to_convert:
+            prices = Uom.compute_price_many(
+                [p.default_uom for p in to_convert],
+                [res[p.id] for p in to_convert],
+                [to_uom] * len(to_convert))
+            res.update(zip((p.id for p in to_convert), prices))
         return res
 
     @classmethod
@@ -597,11 +881,69 @@ class Product(
     def default_code_readonly(cls):
         pool = Pool()
         Configuration = pool.get('product.configuration')
-        config = Configuration(1)
-        return bool(config.product_sequence)
+        return bool(Configuration.get_sequences()['product_sequence'])
 
-    def get_code_readonly(self, name):
-        return self.default_code_readonly()
+    @classmethod
+    def get_code_readonly(cls, records, name):
+        code_readonly = cls.default_code_readonly()
+        return {r.id: code_readonly for r in records}
+
+    @classmethod
+    def lookup_codes(cls, codes):
+        """Return a dictionary mapping each code to the id of the product
+        which has it as code or as identifier
+
+        The code of the variant has priority over the identifiers which are
+        ordered by sequence.
+        Unknown codes are missing from the result."""
+        pool = Pool()
+        Identifier = pool.get('product.identifier')
+        product = cls.__table__()
+        product_i = cls.__table__()
+        identifier = Identifier.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        # Normalize the codes like the identifiers of any type
+        types = [None] + [
+            t for t, _ in Identifier.type.selection if _stdnum_module(t)]
+        compacts = defaultdict(set)
+        for code in codes:
+            compacts[code].add(code)
+            for type_ in types:
+                compacts[Identifier.compact(type_, code)].add(code)
+
+        where = where_i = Literal(True)
+        if transaction.context.get('active_test', True):
+            where &= product.active == Literal(True)
+            where_i &= product_i.active == Literal(True)
+        rows = []
+        for sub_codes in grouped_slice(compacts):
+            sub_codes = list(sub_codes)
+            query = product.select(
+                Literal(0).as_('priority'),
+                Literal(None).as_('sequence'),
+                product.id.as_('product'),
+                product.code.as_('code'),
+                where=product.code.in_(sub_codes) & where)
+            query |= identifier.join(product_i,
+                condition=identifier.product == product_i.id
+                ).select(
+                Literal(1).as_('priority'),
+                identifier.sequence.as_('sequence'),
+                identifier.product.as_('product'),
+                identifier.compact_code.as_('code'),
+                where=identifier.compact_code.in_(sub_codes) & where_i)
+            query.all_ = True
+            cursor.execute(*query)
+            rows.extend(cursor)
+
+        result = {}
+        rows.sort(key=lambda r: (r[0], r[1] is not None, r[1] or 0))
+        for _, _, product_id, compact_code in rows:
+            for code in compacts[compact_code]:
+                result.setdefault(code, product_id)
+        return result
 
     def identifier_get(self, types=None):
         "Return the first identifier for the given types"
@@ -611,30 +953,92 @@ class Product(
             if identifier.type in types:
                 return identifier
 
+    @classmethod
+    def identifiers_get(cls, products, types=None):
+        """Return a dictionary mapping the id of each product to its first
+        identifier for the given types or None"""
+        pool = Pool()
+        Identifier = pool.get('product.identifier')
+        if isinstance(types, str) or types is None:
+            types = {types}
+        types = tuple(sorted(types, key=lambda t: t or ''))
+
+        transaction = Transaction()
+        cache = _identifiers_get_cache.setdefault(transaction, {}).setdefault(
+            (transaction.user, types), {})
+        identifier_ids, missing = {}, []
+        for product in products:
+            product_id = int(product)
+            identifier_id = cache.get(product_id, -1)
+            if identifier_id == -1:
+                missing.append(product_id)
+            else:
+                identifier_ids[product_id] = identifier_id
+
+        for sub_products in grouped_slice(missing):
+            sub_products = list(sub_products)
+            sub_identifiers = dict.fromkeys(sub_products)
+            for identifier in Identifier.search([
+                        ('product', 'in', sub_products),
+                        ('type', 'in', types),
+                        ]):
+                if sub_identifiers[identifier.product.id] is None:
+                    sub_identifiers[identifier.product.id] = identifier.id
+            cache.update(sub_identifiers)
+            identifier_ids.update(sub_identifiers)
+
+        identifiers = Identifier.browse(
+            [i for i in identifier_ids.values() if i is not None])
+        identifiers = {i.id: i for i in identifiers}
+        return {
+            p: identifiers.get(i) for p, i in identifier_ids.items()}
+
     @classmethod
     def _new_suffix_code(cls):
+        return cls._new_suffix_codes(1)[0]
+
+    @classmethod
+    def _new_suffix_codes(cls, count):
         pool = Pool()
         Configuration = pool.get('product.configuration')
-        config = Configuration(1)
-        sequence = config.product_sequence
+        Sequence = pool.get('ir.sequence')
+        sequence = Configuration.get_sequences()['product_sequence']
         if sequence:
-            return sequence.get()
+            return Sequence(sequence).get_many(count)
+        return [None] * count
 
     @classmethod
     def create(cls, vlist):
         vlist = [x.copy() for x in vlist]
-        for values in vlist:
-            if not values.get('suffix_code'):
-                values['suffix_code'] = cls._new_suffix_code()
-        products = super().create(vlist)
+        missing = [v for v in vlist if not v.get('suffix_code')]
+        if len(missing) == 1:
+            missing[0]['suffix_code'] = cls._new_suffix_code()
+        elif missing:
+            for values, code in zip(
+                    missing, cls._new_suffix_codes(len(missing))):
+                values['suffix_code'] = code
+        pool = Pool()
+        Search = pool.get('product.product.search')
+        # The tokens are updated once the identifiers are created
+        with Transaction().set_context(_update_product_search=False):
+            products = super().create(vlist)
         cls.sync_code(products)
+        Search.update(products)
         return products
 
     @classmethod
     def write(cls, *args):
+        pool = Pool()
+        Search = pool.get('product.product.search')
         super().write(*args)
-        products = sum(args[0:None:2], [])
-        cls.sync_code(products)
+        products = []
+        actions = iter(args)
+        for records, values in zip(actions, actions):
+            if values.keys() & {'code', 'suffix_code', 'template'}:
+                products.extend(records)
+        if products:
+            cls.sync_code(products)
+            Search.update(products)
 
     @classmethod
     def copy(cls, products, default=None):
@@ -644,6 +1048,7 @@ class Product(
             default = default.copy()
         default.setdefault('suffix_code', None)
         default.setdefault('code', None)
+        default.setdefault('search_tokens', None)
         return super().copy(products, default=default)
 
     @property
@@ -653,16 +1058,143 @@ class Product(
                 transaction.set_context(self._context):
             return self.template.get_multivalue('list_price')
 
+    @classmethod
+    def reprice(cls, domain, name, method, value, company=None, uom=None):
+        """Set the price name of the products matching domain
+
+        The method 'fixed' sets value as price, value is expressed in uom if
+        set and the products of other categories are skipped.
+        The method 'percentage' increases the existing prices by value
+        expressed as a fraction (0.1 for +10%) which must be greater than -1.
+        The prices are updated for the company or the context company.
+        """
+        pool = Pool()
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        product = cls.__table__()
+        template = Template.__table__()
+
+        if company is None:
+            company = transaction.context.get('company')
+        if company is None:
+            raise ValueError("missing company to reprice")
+        company = int(company)
+        if method not in {'fixed', 'percentage'}:
+            raise ValueError("unknown reprice method %r" % method)
+        if uom is not None and method != 'fixed':
+            raise ValueError("uom only allowed with fixed method")
+        if method == 'percentage' and value <= -1:
+            raise ValueError("percentage must be greater than -1")
+
+        query = cls.search(domain, order=[], query=True)
+        if name == 'list_price':
+            Model = Template
+            targets = template.select(
+                template.id, template.default_uom,
+                where=template.id.in_(product.select(
+                        product.template, where=product.id.in_(query))))
+        elif name == 'cost_price':
+            Model = cls
+            targets = product.join(template,
+                condition=product.template == template.id
+                ).select(
+                    product.id, template.default_uom,
+                    where=product.id.in_(query))
+        else:
+            raise ValueError("unknown price %r" % name)
+        Value = Model.multivalue_model(name)
+        table = Value.__table__()
+        parent, = (f for f, field in Value._fields.items()
+            if field._type == 'many2one'
+            and field.model_name == Model.__name__)
+        parent = Column(table, parent)
+        column = Column(table, name)
+        field = Value._fields[name]
+
+        where = Literal(True)
+        if method == 'percentage':
+            price = _round_price_sql(
+                column * field.sql_format(1 + value))
+        elif uom is not None:
+            factor = Uom.compute_qty_sql(1, targets.default_uom, uom)
+            price = _round_price_sql(
+                field.sql_cast(factor) * field.sql_format(value))
+            # Skip the products of other categories
+            where &= factor != Null
+        else:
+            price = Literal(field.sql_format(round_price(value)))
+
+        cursor.execute(*table.update(
+                [column, table.write_uid, table.write_date],
+                [price, transaction.user, CurrentTimestamp()],
+                from_=[targets],
+                where=(parent == targets.id)
+                & (table.company == company)
+                & where))
+        if method == 'fixed':
+            existing = table.select(
+                parent, where=table.company == company)
+            cursor.execute(*table.insert(
+                    [parent, table.company, column,
+                        table.create_uid, table.create_date],
+                    targets.select(
+                        targets.id, Literal(company), price,
+                        Literal(transaction.user), CurrentTimestamp(),
+                        where=~targets.id.in_(existing) & where)))
+
+        transaction.counter += 1
+        for cache in transaction.cache.values():
+            for model in [Template.__name__, cls.__name__, Value.__name__]:
+                cache.pop(model, None)
+
     @classmethod
     def sync_code(cls, products):
+        pool = Pool()
+        Template = pool.get('product.template')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        template = Template.__table__()
+
+        code = Concat(
+            Coalesce(template.code, ''), Coalesce(table.suffix_code, ''))
+        join = table.template == template.id
+        outdated = (Coalesce(table.code, '') != code) | (table.code == '')
+
+        ids = []
+        for sub_products in grouped_slice(products):
+            cursor.execute(*table.join(template, condition=join).select(
+                    table.id,
+                    where=reduce_ids(table.id, map(int, sub_products))
+                    & outdated))
+            ids.extend(i for i, in cursor)
+        if not ids:
+            return
+
+        for sub_ids in grouped_slice(ids):
+            try:
+                cursor.execute(*table.update(
+                        [table.code, table.write_uid, table.write_date],
+                        [NullIf(code, ''), transaction.user,
+                            CurrentTimestamp()],
+                        from_=[template],
+                        where=reduce_ids(table.id, sub_ids) & join))
+            except backend.DatabaseIntegrityError:
+                raise SQLConstraintError(
+                    gettext('product.msg_product_code_unique'))
+
+        transaction.counter += 1
         for product in products:
-            code = ''.join(filter(None, [
-                        product.prefix_code, product.suffix_code]))
-            if not code:
-                code = None
-            if code != product.code:
-                product.code = code
-        cls.save(products)
+            product._local_cache.pop(product.id, None)
+        for cache in transaction.cache.values():
+            if cls.__name__ in cache:
+                cache_cls = cache[cls.__name__]
+                for id_ in ids:
+                    cache_cls.pop(id_, None)
+        # Emulate constraints not supported by the backend
+        cls.validate(cls.browse(ids))
 
 
 class ProductListPrice(ModelSQL, CompanyValueMixin):
@@ -843,6 +1375,23 @@ class TemplateCategoryAll(UnionMixin, ModelSQL):
         return ['product.template-product.category']
 
 
+@lru_cache(maxsize=None)
+def _stdnum_module(type_):
+    "Return the stdnum module validating the identifier type or None"
+    if not type_ or type_ == 'other':
+        return None
+    try:
+        return import_module('stdnum.%s' % type_)
+    except ImportError:
+        return None
+
+
+def _invalid_codes(type_, codes):
+    "Return the indexes of the invalid codes for the identifier type"
+    module = _stdnum_module(type_)
+    return [i for i, code in enumerate(codes) if not module.is_valid(code)]
+
+
 class ProductIdentifier(sequence_ordered(), ModelSQL, ModelView):
     "Product Identifier"
     __name__ = 'product.identifier'
@@ -861,6 +1410,7 @@ class ProductIdentifier(sequence_ordered(), ModelSQL, ModelView):
             ], "Type")
     type_string = type.translated('type')
     code = fields.Char("Code", required=True)
+    compact_code = fields.Char("Compact Code", readonly=True)
 
     @classmethod
     def __setup__(cls):
@@ -873,31 +1423,141 @@ class ProductIdentifier(sequence_ordered(), ModelSQL, ModelView):
                     t,
                     (t.product, Index.Equality()),
                     (t.code, Index.Similarity())),
+                Index(t, (t.compact_code, Index.Equality())),
                 })
 
+    @classmethod
+    def __register__(cls, module):
+        table = cls.__table__()
+        table_h = cls.__table_handler__(module)
+        fill_compact_code = not table_h.column_exist('compact_code')
+        super().__register__(module)
+        cursor = Transaction().connection.cursor()
+        update = Transaction().connection.cursor()
+
+        if fill_compact_code:
+            cursor.execute(*table.select(table.id, table.type, table.code))
+            for id_, type_, code in cursor:
+                update.execute(*table.update(
+                        [table.compact_code],
+                        [cls.compact(type_, code)],
+                        where=table.id == id_))
+
+    @classmethod
+    def compact(cls, type_, code):
+        "Return the normalized form of code used for exact lookups"
+        if code is None:
+            return None
+        module = _stdnum_module(type_)
+        if module:
+            try:
+                return module.compact(code)
+            except stdnum.exceptions.ValidationError:
+                pass
+        return stdnum.util.clean(code, ' -').strip()
+
+    @classmethod
+    def create(cls, vlist):
+        pool = Pool()
+        Search = pool.get('product.product.search')
+        vlist = [v.copy() for v in vlist]
+        for values in vlist:
+            values['compact_code'] = cls.compact(
+                values.get('type'), values.get('code'))
+        identifiers = super().create(vlist)
+        Search.update({v['product'] for v in vlist})
+        _identifiers_get_cache.pop(Transaction(), None)
+        return identifiers
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Search = pool.get('product.product.search')
+        products = set()
+        to_compact = []
+        actions = iter(args)
+        for identifiers, values in zip(actions, actions):
+            if values.keys() & {'code', 'product'}:
+                products.update(i.product.id for i in identifiers)
+                if values.get('product'):
+                    products.add(values['product'])
+            if values.keys() & {'type', 'code'}:
+                to_compact.extend(identifiers)
+        super().write(*args)
+        if to_compact:
+            compact_codes = defaultdict(list)
+            for identifier in to_compact:
+                compact_codes[
+                    cls.compact(identifier.type, identifier.code)].append(
+                    identifier)
+            to_write = []
+            for compact_code, identifiers in compact_codes.items():
+                to_write.extend(
+                    [identifiers, {'compact_code': compact_code}])
+            super().write(*to_write)
+        if products:
+            Search.update(products)
+        _identifiers_get_cache.pop(Transaction(), None)
+
+    @classmethod
+    def delete(cls, identifiers):
+        pool = Pool()
+        Search = pool.get('product.product.search')
+        products = {i.product.id for i in identifiers}
+        super().delete(identifiers)
+        Search.update(products)
+        _identifiers_get_cache.pop(Transaction(), None)
+
     @fields.depends('type', 'code')
     def on_change_with_code(self):
-        if self.type and self.type != 'other':
+        module = _stdnum_module(self.type)
+        if module:
             try:
-                module = import_module('stdnum.%s' % self.type)
                 return module.compact(self.code)
-            except ImportError:
-                pass
             except stdnum.exceptions.ValidationError:
                 pass
         return self.code
 
     def pre_validate(self):
         super().pre_validate()
-        self.check_code()
+        if Transaction().context.get('_check_identifier_code', True):
+            self.check_code()
+
+    @classmethod
+    def validate_codes(cls, identifiers, processes=0):
+        """Check the codes of the identifiers grouped by type
+
+        The checks are distributed over a pool of spawned processes when
+        processes is greater than 1 and there are many codes."""
+        type2identifiers = defaultdict(list)
+        for identifier in identifiers:
+            if _stdnum_module(identifier.type):
+                type2identifiers[identifier.type].append(identifier)
+        chunks = []
+        for type_, type_identifiers in type2identifiers.items():
+            for sub_identifiers in grouped_slice(
+                    type_identifiers, _validation_chunk_size):
+                chunks.append((type_, list(sub_identifiers)))
+        args = (
+            [t for t, _ in chunks],
+            [[i.code for i in c] for _, c in chunks])
+        if processes > 1 and len(chunks) > 1:
+            # Do not fork the server process which holds connections
+            with ProcessPoolExecutor(
+                    processes,
+                    mp_context=multiprocessing.get_context('spawn')
+                    ) as executor:
+                results = list(executor.map(_invalid_codes, *args))
+        else:
+            results = map(_invalid_codes, *args)
+        for (_, sub_identifiers), invalids in zip(chunks, results):
+            for index in invalids:
+                sub_identifiers[index].check_code()
 
     @fields.depends('type', 'product', 'code')
     def check_code(self):
-        if self.type:
-            try:
-                module = import_module('stdnum.%s' % self.type)
-            except ModuleNotFoundError:
-                return
+        module = _stdnum_module(self.type)
+        if module:
             if not module.is_valid(self.code):
                 if self.product and self.product.id > 0:
                     product = self.product.rec_name
@@ -908,3 +1568,97 @@ class ProductIdentifier(sequence_ordered(), ModelSQL, ModelView):
                         type=self.type_string,
                         code=self.code,
                         product=product))
+
+
+class ProductSearch(ModelSQL):
+    "Product Search"
+    __name__ = 'product.product.search'
+    product = fields.Many2One(
+        'product.product', "Variant", required=True, ondelete='CASCADE')
+    type = fields.Selection([
+            ('name', "Name"),
+            ('code', "Code"),
+            ], "Type", required=True)
+    token = fields.Char("Token", required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t, (t.product, Index.Equality())),
+                Index(t, (t.token, Index.Similarity())),
+                })
+
+    @classmethod
+    def __register__(cls, module):
+        pool = Pool()
+        Product = pool.get('product.product')
+        product = Product.__table__()
+        cursor = Transaction().connection.cursor()
+        exist = backend.TableHandler.table_exist(cls._table)
+
+        super().__register__(module)
+
+        if not exist:
+            cursor.execute(*product.select(product.id))
+            cls.update([i for i, in cursor])
+
+    @classmethod
+    def update(cls, products):
+        "Update the tokens of the products"
+        if not Transaction().context.get('_update_product_search', True):
+            return
+        pool = Pool()
+        Product = pool.get('product.product')
+        Template = pool.get('product.template')
+        Identifier = pool.get('product.identifier')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        product = Product.__table__()
+        template = Template.__table__()
+        identifier = Identifier.__table__()
+
+        columns = [
+            table.product, table.type, table.token,
+            table.create_uid, table.create_date]
+        extra = [Literal(transaction.user), CurrentTimestamp()]
+        ids = list({int(p) for p in products})
+        for sub_ids in grouped_slice(ids):
+            sub_ids = list(sub_ids)
+            cursor.execute(*table.delete(
+                    where=reduce_ids(table.product, sub_ids)))
+            for type_, token in [
+                    ('code', product.code),
+                    ('code', template.code),
+                    ('name', template.name),
+                    ]:
+                cursor.execute(*table.insert(columns,
+                        product.join(template,
+                            condition=product.template == template.id
+                            ).select(
+                            product.id, Literal(type_), token, *extra,
+                            where=reduce_ids(product.id, sub_ids)
+                            & (token != Null))))
+            cursor.execute(*table.insert(columns,
+                    identifier.select(
+                        identifier.product, Literal('code'), identifier.code,
+                        *extra,
+                        where=reduce_ids(identifier.product, sub_ids))))
+
+    @classmethod
+    def update_templates(cls, templates):
+        "Update the tokens of the variants of the templates"
+        pool = Pool()
+        Product = pool.get('product.product')
+        product = Product.__table__()
+        cursor = Transaction().connection.cursor()
+
+        ids = []
+        for sub_templates in grouped_slice(templates):
+            cursor.execute(*product.select(product.id,
+                    where=reduce_ids(
+                        product.template, map(int, sub_templates))))
+            ids.extend(i for i, in cursor)
+        cls.update(ids)
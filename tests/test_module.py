@@ -1,11 +1,18 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 
-from decimal import Decimal
-
-from trytond.modules.company.tests import CompanyTestMixin
-from trytond.modules.product import round_price
-from trytond.modules.product.exceptions import UOMAccessError
+from decimal import ROUND_HALF_UP, Decimal
+from unittest.mock import patch
+
+from sql import Literal
+
+from trytond.model.exceptions import AccessError, SQLConstraintError
+from trytond.modules.company.tests import (
+    CompanyTestMixin, create_company, set_company)
+from trytond.modules.product import product as product_module
+from trytond.modules.product import round_price, round_prices
+from trytond.modules.product.exceptions import (
+    InvalidIdentifierCode, UOMAccessError)
 from trytond.pool import Pool
 from trytond.tests.test_tryton import ModuleTestCase, with_transaction
 from trytond.transaction import Transaction
@@ -167,6 +174,157 @@ class ProductTestCase(CompanyTestMixin, ModuleTestCase):
         self.assertRaises(ValueError, Uom.compute_qty,
             from_uom, qty, None, True)
 
+    @with_transaction()
+    def test_uom_compute_qty_many(self):
+        "Test uom compute_qty_many"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        tests = [
+            ('Kilogram', 100, 'Gram'),
+            ('Gram', 1, 'Pound'),
+            ('Second', 5, 'Minute'),
+            ('Second', 25, 'Hour'),
+            ('Millimeter', 3, 'Inch'),
+            ('Millimeter', 0, 'Inch'),
+            ('Millimeter', None, 'Inch'),
+            ('Second', 7, 'Minute'),
+            ('Kilogram', 0.3, 'Gram'),
+            ]
+        from_uoms, quantities, to_uoms = [], [], []
+        for from_name, qty, to_name in tests:
+            from_uom, = Uom.search([('name', '=', from_name)], limit=1)
+            to_uom, = Uom.search([('name', '=', to_name)], limit=1)
+            from_uoms.append(from_uom)
+            quantities.append(qty)
+            to_uoms.append(to_uom)
+        from_uoms.append(None)
+        quantities.append(0.2)
+        to_uoms.append(None)
+
+        for round in [False, True]:
+            with self.subTest(round=round):
+                self.assertEqual(
+                    Uom.compute_qty_many(
+                        from_uoms, quantities, to_uoms, round=round),
+                    [Uom.compute_qty(f, q, t, round=round)
+                        for f, q, t in zip(from_uoms, quantities, to_uoms)])
+
+        self.assertRaises(ValueError, Uom.compute_qty_many,
+            from_uoms, quantities, to_uoms[:-1])
+        self.assertRaises(ValueError, Uom.compute_qty_many,
+            [from_uoms[0]], [1], [None])
+
+    @with_transaction()
+    def test_uom_compute_qty_exact(self):
+        "Test uom compute_qty with exact"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        tests = [
+            ('Kilogram', 100, 'Gram', 100000.0),
+            ('Gram', 1, 'Pound', 0.0),
+            ('Second', 5, 'Minute', 0.08),
+            ('Second', 25, 'Hour', 0.01),
+            ('Millimeter', 3, 'Inch', 0.12),
+            ('Millimeter', 0, 'Inch', 0),
+            ('Millimeter', None, 'Inch', None),
+            ('Kilogram', 2.675, 'Kilogram', 2.68),
+            ('Centimeter', Decimal('12345678901234.5'), 'Meter',
+                Decimal('123456789012.34')),
+            ]
+        for from_name, qty, to_name, result in tests:
+            from_uom, = Uom.search([('name', '=', from_name)], limit=1)
+            to_uom, = Uom.search([('name', '=', to_name)], limit=1)
+            with self.subTest(from_uom=from_name, qty=qty, to_uom=to_name):
+                value = Uom.compute_qty(from_uom, qty, to_uom, exact=True)
+                self.assertEqual(value, result)
+                self.assertIsInstance(value, type(result))
+
+        cm, = Uom.search([('name', '=', "Centimeter")])
+        m, = Uom.search([('name', '=', "Meter")])
+        self.assertEqual(
+            Uom.compute_qty(
+                cm, Decimal('12345678901234.567'), m, round=False,
+                exact=True),
+            Decimal('123456789012.34567'))
+
+    @with_transaction()
+    def test_uom_conversion_cache(self):
+        "Test uom conversion cache"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        kg, = Uom.search([('name', '=', "Kilogram")])
+        g, = Uom.search([('name', '=', "Gram")])
+
+        Uom.compute_qty(kg, 1.2345, g)
+        hit = Uom._conversion_cache.hit
+        self.assertEqual(Uom.compute_qty(kg, 1.2345, g), 1234.5)
+        self.assertEqual(Uom._conversion_cache.hit, hit + 1)
+
+        g.rounding = 1
+        g.save()
+        self.assertEqual(Uom.compute_qty(kg, 1.2345, g), 1234)
+
+    @with_transaction()
+    def test_uom_compute_modified_instance(self):
+        "Test uom compute_qty with unsaved modification"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        kg, = Uom.search([('name', '=', "Kilogram")])
+        g, = Uom.search([('name', '=', "Gram")])
+
+        kg.rounding = 0.5
+        self.assertEqual(Uom.compute_qty(g, 3300, kg), 3.5)
+        self.assertEqual(Uom.compute_qty(g, 3300, kg.id), 3.3)
+
+    @with_transaction()
+    def test_uom_compute_missing_id(self):
+        "Test uom compute_qty with missing id"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        kg, = Uom.search([('name', '=', "Kilogram")])
+
+        with self.assertRaises(AccessError):
+            Uom.compute_qty(kg, 1, 99999)
+
+    @with_transaction()
+    def test_uom_compute_with_ids(self):
+        "Test uom compute_qty and compute_price with ids"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        kg, = Uom.search([('name', '=', "Kilogram")])
+        lb, = Uom.search([('name', '=', "Pound")])
+
+        self.assertEqual(
+            Uom.compute_qty(kg.id, 1.2345, lb.id),
+            Uom.compute_qty(kg, 1.2345, lb))
+        self.assertEqual(
+            Uom.compute_price(kg.id, Decimal('1.2345'), lb.id),
+            Uom.compute_price(kg, Decimal('1.2345'), lb))
+        self.assertEqual(
+            Uom.compute_qty_many([kg.id, lb], [1, 2], [lb.id, kg.id]),
+            Uom.compute_qty_many([kg, lb], [1, 2], [lb, kg]))
+
+    @with_transaction()
+    def test_uom_compute_qty_sql(self):
+        "Test uom compute_qty_sql"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        table = Uom.__table__()
+        cursor = Transaction().connection.cursor()
+
+        for to_name in ['Gram', 'Pound', 'Kilogram', 'Ounce']:
+            to_uom, = Uom.search([('name', '=', to_name)])
+            cursor.execute(*table.select(
+                    table.id, table.category,
+                    Uom.compute_qty_sql(Literal(12.345), table.id, to_uom)))
+            for uom_id, category, quantity in cursor:
+                with self.subTest(to_uom=to_name, uom=uom_id):
+                    if category == to_uom.category.id:
+                        self.assertEqual(quantity, Uom.compute_qty(
+                                Uom(uom_id), 12.345, to_uom, round=False))
+                    else:
+                        self.assertEqual(quantity, None)
+
     @with_transaction()
     def test_uom_compute_qty_category(self):
         "Test uom compute_qty with different category"
@@ -190,6 +348,70 @@ class ProductTestCase(CompanyTestMixin, ModuleTestCase):
                 Uom.compute_qty(g, quantity, m3, **keys), result,
                 msg=msg)
 
+    @with_transaction()
+    def test_uom_compute_qty_category_conversion(self):
+        "Test uom compute_qty with category conversions"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        UomCategory = pool.get('product.uom.category')
+        Conversion = pool.get('product.uom.category.conversion')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+
+        unit, = Uom.search([('name', '=', "Unit")])
+        kg, = Uom.search([('name', '=', "Kilogram")])
+        g, = Uom.search([('name', '=', "Gram")])
+        liter, = Uom.search([('name', '=', "Liter")])
+        units, = UomCategory.search([('name', '=', "Units")])
+        weight, = UomCategory.search([('name', '=', "Weight")])
+        volume, = UomCategory.search([('name', '=', "Volume")])
+        template = Template(name="Oil", default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+
+        with self.assertRaises(ValueError):
+            Uom.compute_qty(liter, 2, g)
+
+        water, = Conversion.create([{
+                    'from_category': volume.id,
+                    'to_category': weight.id,
+                    'factor': 1,
+                    'rate': 1,
+                    }])
+        Conversion.create([{
+                    'from_category': volume.id,
+                    'to_category': weight.id,
+                    'template': template.id,
+                    'factor': 0.9,
+                    'rate': round(1 / 0.9, 12),
+                    }, {
+                    'from_category': units.id,
+                    'to_category': volume.id,
+                    'template': template.id,
+                    'factor': 0.5,
+                    'rate': 2,
+                    }])
+
+        self.assertEqual(Uom.compute_qty(liter, 2, g), 2000)
+        self.assertEqual(Uom.compute_qty(kg, 3, liter), 3)
+        self.assertEqual(
+            Uom.compute_qty(liter, 2, kg, product=template), 1.8)
+        self.assertEqual(Uom.compute_qty(unit, 4, kg, product=product), 1.8)
+        self.assertEqual(Uom.compute_qty(kg, 1.8, unit, product=product), 4)
+        with self.assertRaises(ValueError):
+            Uom.compute_qty(unit, 4, kg)
+        self.assertEqual(
+            Uom.compute_qty_many(
+                [liter, liter, unit], [2, 2, 4], [kg, kg, kg],
+                products=[None, product, product]),
+            [2, 1.8, 1.8])
+
+        water.factor = 2
+        water.rate = 0.5
+        water.save()
+        self.assertEqual(Uom.compute_qty(liter, 2, kg), 4)
+
     @with_transaction()
     def test_uom_compute_price(self):
         'Test uom compute_price function'
@@ -234,6 +456,36 @@ class ProductTestCase(CompanyTestMixin, ModuleTestCase):
         self.assertRaises(ValueError, Uom.compute_price,
             from_uom, price, None)
 
+    @with_transaction()
+    def test_uom_compute_price_many(self):
+        "Test uom compute_price_many"
+        pool = Pool()
+        Uom = pool.get('product.uom')
+        tests = [
+            ('Kilogram', Decimal('100'), 'Gram'),
+            ('Gram', Decimal('1'), 'Pound'),
+            ('Second', Decimal('5'), 'Minute'),
+            ('Second', Decimal('25'), 'Hour'),
+            ('Millimeter', Decimal('3'), 'Inch'),
+            ('Millimeter', Decimal('0'), 'Inch'),
+            ('Millimeter', None, 'Inch'),
+            ('Second', Decimal('7.1234'), 'Minute'),
+            ]
+        from_uoms, prices, to_uoms = [], [], []
+        for from_name, price, to_name in tests:
+            from_uom, = Uom.search([('name', '=', from_name)], limit=1)
+            to_uom, = Uom.search([('name', '=', to_name)], limit=1)
+            from_uoms.append(from_uom)
+            prices.append(price)
+            to_uoms.append(to_uom)
+
+        self.assertEqual(
+            Uom.compute_price_many(from_uoms, prices, to_uoms),
+            [Uom.compute_price(f, p, t)
+                for f, p, t in zip(from_uoms, prices, to_uoms)])
+        self.assertRaises(ValueError, Uom.compute_price_many,
+            from_uoms, prices, to_uoms[:-1])
+
     @with_transaction()
     def test_uom_compute_price_category(self):
         "Test uom compute_price with different category"
@@ -489,6 +741,703 @@ class ProductTestCase(CompanyTestMixin, ModuleTestCase):
                 [('name', 'like', '%')], order=[('type', 'DESC')]),
                 [product2, product1])
 
+    @with_transaction()
+    def test_product_template_function(self):
+        "Test reading template fields from products"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Category = pool.get('product.category')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        kilogram, = Uom.search([('name', '=', 'Kilogram')])
+        category = Category(name="Category")
+        category.save()
+        template1 = Template(
+            name="Product A", code="A", type='goods', default_uom=unit,
+            categories=[category])
+        template2 = Template(
+            name="Product B", type='service', default_uom=kilogram)
+        Template.save([template1, template2])
+        products = [
+            Product(template=template1, suffix_code="1"),
+            Product(template=template1, suffix_code="2"),
+            Product(template=template2),
+            ]
+        Product.save(products)
+
+        self.assertEqual(
+            Product.read([p.id for p in products],
+                ['name', 'type', 'prefix_code', 'default_uom',
+                    'default_uom_category', 'categories']),
+            [{
+                    'id': products[0].id,
+                    'name': "Product A",
+                    'type': 'goods',
+                    'prefix_code': "A",
+                    'default_uom': unit.id,
+                    'default_uom_category': unit.category.id,
+                    'categories': [category.id],
+                    }, {
+                    'id': products[1].id,
+                    'name': "Product A",
+                    'type': 'goods',
+                    'prefix_code': "A",
+                    'default_uom': unit.id,
+                    'default_uom_category': unit.category.id,
+                    'categories': [category.id],
+                    }, {
+                    'id': products[2].id,
+                    'name': "Product B",
+                    'type': 'service',
+                    'prefix_code': None,
+                    'default_uom': kilogram.id,
+                    'default_uom_category': kilogram.category.id,
+                    'categories': [],
+                    }])
+        self.assertEqual(products[2].default_uom, kilogram)
+
+    @with_transaction()
+    def test_product_search_template_function(self):
+        "Test searching products on template fields"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        kilogram, = Uom.search([('name', '=', 'Kilogram')])
+        template1 = Template(
+            name="Product A", type='goods', default_uom=unit)
+        template2 = Template(
+            name="Product B", type='service', default_uom=kilogram)
+        template3 = Template(
+            name="Product C", type='goods', default_uom=kilogram)
+        Template.save([template1, template2, template3])
+        product1, product2, product3 = products = [
+            Product(template=t) for t in [template1, template2, template3]]
+        Product.save(products)
+
+        for domain, result in [
+                ([
+                        ('type', '=', 'goods'),
+                        ('default_uom.name', '=', 'Kilogram'),
+                        ], [product3]),
+                ([
+                        'OR',
+                        ('type', '=', 'service'),
+                        ('name', '=', "Product A"),
+                        ], [product1, product2]),
+                ([
+                        ('suffix_code', '=', None),
+                        ['OR',
+                            ('type', '=', 'service'),
+                            ('default_uom', '=', unit.id),
+                            ],
+                        ('name', 'like', "Product%"),
+                        ], [product1, product2]),
+                ]:
+            with self.subTest(domain=domain):
+                self.assertEqual(
+                    Product.search(domain, order=[('id', 'ASC')]), result)
+
+    @with_transaction()
+    def test_product_search_template_function_query(self):
+        "Test search on template fields uses a single sub-query"
+        pool = Pool()
+        Product = pool.get('product.product')
+        Template = pool.get('product.template')
+
+        query = Product.search([
+                ('type', '=', 'goods'),
+                ('consumable', '=', False),
+                ('default_uom', '=', None),
+                ], order=[], query=True)
+
+        self.assertEqual(
+            str(query).count('"%s"' % Template._table), 1)
+
+    @with_transaction()
+    def test_product_sync_code(self):
+        "Test synchronization of product code"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name="Product", default_uom=unit)
+        template.save()
+        product1 = Product(template=template, suffix_code="1")
+        product2 = Product(template=template)
+        Product.save([product1, product2])
+        self.assertEqual([product1.code, product2.code], ["1", None])
+
+        template.code = "P"
+        template.save()
+        self.assertEqual([product1.code, product2.code], ["P1", "P"])
+
+        product2.suffix_code = "2"
+        product2.save()
+        self.assertEqual([product1.code, product2.code], ["P1", "P2"])
+
+        write_date = product1.write_date
+        Product.sync_code([product1, product2])
+        self.assertEqual(product1.write_date, write_date)
+
+        Template.write([template], {'code': None})
+        Product.write([product1, product2], {'suffix_code': None})
+        self.assertEqual([product1.code, product2.code], [None, None])
+
+        with self.assertRaises(SQLConstraintError):
+            Product.write([product1, product2], {'suffix_code': "1"})
+
+    @with_transaction()
+    def test_template_write_sync_code(self):
+        "Test template write synchronizes code only when code is written"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+        product_table = Product.__table__()
+        cursor = Transaction().connection.cursor()
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name="Product", code="P", default_uom=unit)
+        template.save()
+        product = Product(template=template, suffix_code="1")
+        product.save()
+        cursor.execute(*product_table.update(
+                [product_table.code], ["X"],
+                where=product_table.id == product.id))
+
+        Template.write([template], {'name': "Renamed"})
+        product = Product(product.id)
+        self.assertEqual(product.code, "X")
+
+        Template.write([template], {'code': "Q"})
+        product = Product(product.id)
+        self.assertEqual(product.code, "Q1")
+
+    @with_transaction()
+    def test_template_import_catalog(self):
+        "Test import of catalog"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Identifier = pool.get('product.identifier')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+
+        def rows():
+            for i in range(5):
+                yield {
+                    'name': "Product %s" % i,
+                    'code': "P%s" % i,
+                    'default_uom': unit.id,
+                    'products': [('create', [{
+                                    'suffix_code': "1",
+                                    'identifiers': [('create', [{
+                                                    'code': "C%s" % i,
+                                                    }])],
+                                    }, {
+                                    'suffix_code': "2",
+                                    }])],
+                    }
+
+        self.assertEqual(Template.import_catalog(rows(), chunk_size=2), 5)
+        self.assertEqual(Template.search([], count=True), 5)
+        self.assertEqual(Product.search([], count=True), 10)
+        self.assertEqual(Identifier.search([], count=True), 5)
+        product, = Product.search([('code', '=', "P32")])
+        self.assertEqual(product.name, "Product 3")
+
+        with self.assertRaises(InvalidIdentifierCode):
+            Template.import_catalog([{
+                        'name': "Invalid",
+                        'default_uom': unit.id,
+                        'products': [('create', [{
+                                        'identifiers': [('create', [{
+                                                        'type': 'ean',
+                                                        'code': "123",
+                                                        }])],
+                                        }])],
+                        }])
+
+    @with_transaction()
+    def test_template_create_sequence_codes(self):
+        "Test codes of templates and products are allocated from sequences"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Configuration = pool.get('product.configuration')
+        Sequence = pool.get('ir.sequence')
+        ModelData = pool.get('ir.model.data')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template_sequence, product_sequence = Sequence.create([{
+                    'name': "Template",
+                    'sequence_type': ModelData.get_id(
+                        'product', 'sequence_type_template'),
+                    'prefix': "T",
+                    'padding': 3,
+                    'number_increment': 2,
+                    }, {
+                    'name': "Product",
+                    'sequence_type': ModelData.get_id(
+                        'product', 'sequence_type_product'),
+                    'prefix': "-",
+                    }])
+        configuration = Configuration(1)
+        configuration.template_sequence = template_sequence
+        configuration.product_sequence = product_sequence
+        configuration.save()
+
+        templates = Template.create([{
+                    'name': "Product %s" % i,
+                    'code': "C" if i == 1 else None,
+                    'default_uom': unit.id,
+                    'products': [('create', [{}, {}])],
+                    } for i in range(3)])
+
+        self.assertEqual(
+            [t.code for t in templates], ["T001", "C", "T003"])
+        self.assertEqual(
+            sorted(p.code for p in Product.search([])),
+            ["C-3", "C-4", "T001-1", "T001-2", "T003-5", "T003-6"])
+        self.assertEqual(template_sequence.get(), "T005")
+        self.assertEqual(product_sequence.get_many(2), ["-7", "-8"])
+
+    @with_transaction()
+    def test_template_create_single_code(self):
+        "Test code of single template and product uses the hooks"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        with patch.object(Template, '_new_code', return_value="T"), \
+                patch.object(Product, '_new_suffix_code', return_value="1"):
+            template, = Template.create([{
+                        'name': "Product",
+                        'default_uom': unit.id,
+                        'products': [('create', [{}])],
+                        }])
+
+        self.assertEqual(template.code, "T")
+        self.assertEqual([p.code for p in template.products], ["T1"])
+
+    @with_transaction()
+    def test_code_readonly(self):
+        "Test code readonly follows configuration sequences"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Configuration = pool.get('product.configuration')
+        Sequence = pool.get('ir.sequence')
+        ModelData = pool.get('ir.model.data')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template = Template(name="Product", default_uom=unit)
+        template.save()
+        product = Product(template=template)
+        product.save()
+
+        self.assertEqual(
+            Template.read([template.id], ['code_readonly']),
+            [{'id': template.id, 'code_readonly': False}])
+        self.assertFalse(Product.default_code_readonly())
+
+        sequence = Sequence(
+            name="Template",
+            sequence_type=ModelData.get_id(
+                'product', 'sequence_type_template'))
+        sequence.save()
+        configuration = Configuration(1)
+        configuration.template_sequence = sequence
+        configuration.save()
+
+        self.assertEqual(
+            Template.read([template.id], ['code_readonly']),
+            [{'id': template.id, 'code_readonly': True}])
+        self.assertFalse(Product.default_code_readonly())
+        self.assertEqual(
+            Configuration.get_sequences(), {
+                'template_sequence': sequence.id,
+                'product_sequence': None,
+                })
+
+    @with_transaction()
+    def test_get_multivalues(self):
+        "Test get multivalues of prices"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+
+        gram, = Uom.search([('name', '=', 'Gram')])
+        kilogram, = Uom.search([('name', '=', 'Kilogram')])
+        company1 = create_company()
+        company2 = create_company(name="Company 2")
+
+        with set_company(company1):
+            template1, template2 = Template.create([{
+                        'name': "Product 1",
+                        'default_uom': gram.id,
+                        'list_price': Decimal(10),
+                        'products': [('create', [{
+                                        'cost_price': Decimal(5),
+                                        }])],
+                        }, {
+                        'name': "Product 2",
+                        'default_uom': gram.id,
+                        'products': [('create', [{}])],
+                        }])
+            product1, = template1.products
+            product2, = template2.products
+        with set_company(company2):
+            Template.write([template1], {'list_price': Decimal(20)})
+            Product.write([product1], {'cost_price': Decimal(7)})
+
+        with set_company(company1):
+            self.assertEqual(
+                Template.get_multivalues([template1, template2], 'list_price'),
+                {template1.id: Decimal(10), template2.id: None})
+            self.assertEqual(
+                Template.get_multivalues(
+                    [template1], 'list_price', company=company2.id),
+                {template1.id: Decimal(20)})
+            self.assertEqual(
+                Product.get_multivalues([product1, product2], 'cost_price'),
+                {product1.id: Decimal(5), product2.id: Decimal(0)})
+
+            with Transaction().set_context(uom=kilogram.id):
+                self.assertEqual(
+                    Product.read([product1.id, product2.id],
+                        ['list_price_uom', 'cost_price_uom']), [{
+                            'id': product1.id,
+                            'list_price_uom': Decimal(10000),
+                            'cost_price_uom': Decimal(5000),
+                            }, {
+                            'id': product2.id,
+                            'list_price_uom': None,
+                            'cost_price_uom': Decimal(0),
+                            }])
+        self.assertEqual(
+            Product.get_multivalues([product1], 'cost_price'),
+            {product1.id: None})
+
+    @with_transaction()
+    def test_product_reprice(self):
+        "Test reprice products"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        gram, = Uom.search([('name', '=', 'Gram')])
+        kilogram, = Uom.search([('name', '=', 'Kilogram')])
+        company1 = create_company()
+        company2 = create_company(name="Company 2")
+
+        with set_company(company1):
+            template1, template2, template3 = Template.create([{
+                        'name': "Product 1",
+                        'type': 'goods',
+                        'default_uom': gram.id,
+                        'list_price': Decimal(10),
+                        'products': [('create', [{
+                                        'cost_price': Decimal(5),
+                                        }])],
+                        }, {
+                        'name': "Product 2",
+                        'type': 'service',
+                        'default_uom': unit.id,
+                        'products': [('create', [{
+                                        'cost_price': Decimal(1),
+                                        }])],
+                        }, {
+                        'name': "Product 3",
+                        'type': 'goods',
+                        'default_uom': kilogram.id,
+                        'list_price': Decimal('3.3333'),
+                        'products': [('create', [{}])],
+                        }])
+            product1, = template1.products
+            product2, = template2.products
+            product3, = template3.products
+        with set_company(company2):
+            Template.write([template1], {'list_price': Decimal(20)})
+
+        templates = [template1, template2, template3]
+        products = [product1, product2, product3]
+        with set_company(company1):
+            Product.reprice(
+                [('type', '=', 'goods')], 'list_price',
+                'percentage', Decimal('0.1'))
+            self.assertEqual(
+                Template.get_multivalues(templates, 'list_price'), {
+                    template1.id: Decimal('11.0000'),
+                    template2.id: None,
+                    template3.id: Decimal('3.6666'),
+                    })
+
+            Product.reprice(
+                [], 'cost_price', 'fixed', Decimal(2), uom=kilogram)
+            self.assertEqual(
+                Product.get_multivalues(products, 'cost_price'), {
+                    product1.id: Decimal('0.0020'),
+                    product2.id: Decimal(1),
+                    product3.id: Decimal(2),
+                    })
+
+            Product.reprice(
+                [('type', '=', 'service')], 'list_price',
+                'fixed', Decimal('4.56789'))
+            self.assertEqual(
+                Template.get_multivalues(templates, 'list_price'), {
+                    template1.id: Decimal('11.0000'),
+                    template2.id: Decimal('4.5679'),
+                    template3.id: Decimal('3.6666'),
+                    })
+            self.assertEqual(template2.list_price, Decimal('4.5679'))
+
+            with self.assertRaises(ValueError):
+                Product.reprice([], 'list_price', 'percentage', Decimal(-1))
+
+        self.assertEqual(
+            Template.get_multivalues(
+                [template1], 'list_price', company=company2.id),
+            {template1.id: Decimal(20)})
+
+    @with_transaction()
+    def test_template_cost_price(self):
+        "Test cost price of templates"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        company = create_company()
+
+        with set_company(company):
+            template1, template2, template3, template4 = Template.create([{
+                        'name': "Product 1",
+                        'default_uom': unit.id,
+                        'products': [('create', [{
+                                        'cost_price': Decimal(5),
+                                        }])],
+                        }, {
+                        'name': "Product 2",
+                        'default_uom': unit.id,
+                        'products': [('create', [{
+                                        'suffix_code': "2A",
+                                        'cost_price': Decimal(5),
+                                        }, {
+                                        'suffix_code': "2B",
+                                        'cost_price': Decimal(6),
+                                        }])],
+                        }, {
+                        'name': "Product 3",
+                        'default_uom': unit.id,
+                        'products': [('create', [{
+                                        'suffix_code': "3A",
+                                        'cost_price': Decimal(7),
+                                        }, {
+                                        'suffix_code': "3B",
+                                        'cost_price': Decimal(8),
+                                        'active': False,
+                                        }])],
+                        }, {
+                        'name': "Product 4",
+                        'default_uom': unit.id,
+                        }])
+            templates = [template1, template2, template3, template4]
+
+            self.assertEqual(
+                Template.read([t.id for t in templates], ['cost_price']), [
+                    {'id': template1.id, 'cost_price': Decimal(5)},
+                    {'id': template2.id, 'cost_price': None},
+                    {'id': template3.id, 'cost_price': Decimal(7)},
+                    {'id': template4.id, 'cost_price': None},
+                    ])
+            with Transaction().set_context(active_test=False):
+                self.assertEqual(
+                    Template.read([template3.id], ['cost_price']),
+                    [{'id': template3.id, 'cost_price': None}])
+
+    @with_transaction()
+    def test_product_search_rec_name(self):
+        "Test search products on rec_name"
+        pool = Pool()
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        Identifier = pool.get('product.identifier')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        template1, template2 = Template.create([{
+                    'name': "Chair",
+                    'code': "CH",
+                    'default_uom': unit.id,
+                    'products': [('create', [{
+                                    'suffix_code': "01",
+                                    'identifiers': [('create', [{
+                                                    'code': "4006381333931",
+                                                    }])],
+                                    }, {
+                                    'suffix_code': "02",
+                                    }])],
+                    }, {
+                    'name': "Table",
+                    'default_uom': unit.id,
+                    'products': [('create', [{}])],
+                    }])
+        product1, product2 = sorted(template1.products, key=lambda p: p.code)
+        product3, = template2.products
+
+        def search(value, operator='ilike', model=Product):
+            return model.search(
+                [('rec_name', operator, value)], order=[('id', 'ASC')])
+
+        self.assertEqual(search('%chair%'), [product1, product2])
+        self.assertEqual(search('%CH02%'), [product2])
+        self.assertEqual(search('%4006381%'), [product1])
+        self.assertEqual(search('CH%'), [product1, product2])
+        self.assertEqual(search('Table'), [product3])
+        self.assertEqual(search('%4006381%', model=Template), [template1])
+
+        identifier, = product1.identifiers
+        identifier.code = "9780471117094"
+        identifier.save()
+        self.assertEqual(search('%4006381%'), [])
+        self.assertEqual(search('%9780471%'), [product1])
+        self.assertEqual(search('%9780471%', model=Template), [template1])
+
+        Template.write([template2], {'name': "Desk", 'code': "DK"})
+        self.assertEqual(search('%table%'), [])
+        self.assertEqual(search('%desk%'), [product3])
+        self.assertEqual(search('DK'), [product3])
+
+        Identifier.delete([identifier])
+        self.assertEqual(search('%9780471%'), [])
+
+        product4, = Product.copy([product1])
+        self.assertEqual(search('%chair%'), [product1, product2, product4])
+
+    @with_transaction()
+    def test_category_closure(self):
+        "Test child_of and parent_of of categories use the closure"
+        pool = Pool()
+        Category = pool.get('product.category')
+        Closure = pool.get('product.category.closure')
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+
+        root, other = Category.create([{
+                    'name': "Root",
+                    'childs': [('create', [{
+                                    'name': "A",
+                                    'childs': [('create', [{
+                                                    'name': "A1",
+                                                    }])],
+                                    }, {
+                                    'name': "B",
+                                    }])],
+                    }, {
+                    'name': "Other",
+                    }])
+        a, = Category.search([('name', '=', "A")])
+        a1, = Category.search([('name', '=', "A1")])
+        b, = Category.search([('name', '=', "B")])
+        unit, = Uom.search([], limit=1)
+        template, = Template.create([{
+                    'name': "Product",
+                    'default_uom': unit.id,
+                    'categories': [('add', [a1.id])],
+                    }])
+
+        def search(domain):
+            return set(Category.search(domain))
+
+        self.assertEqual(
+            {(c.descendant, c.depth) for c in Closure.search([
+                        ('ancestor', '=', root.id),
+                        ])},
+            {(root, 0), (a, 1), (b, 1), (a1, 2)})
+
+        self.assertEqual(
+            search([('parent', 'child_of', [root.id])]), {root, a, a1, b})
+        self.assertEqual(search([('parent', 'child_of', a.id)]), {a, a1})
+        self.assertEqual(
+            search([('parent', 'parent_of', [a1.id])]), {root, a, a1})
+        self.assertEqual(
+            search([('parent', 'not child_of', [a.id])]), {root, b, other})
+        self.assertEqual(
+            Template.search([
+                    ('categories_all', 'child_of', [root.id], 'parent'),
+                    ]), [template])
+
+        Category.write([a], {'parent': other.id})
+        self.assertEqual(
+            search([('parent', 'child_of', [root.id])]), {root, b})
+        self.assertEqual(
+            search([('parent', 'parent_of', [a1.id])]), {a, a1, other})
+        self.assertEqual(
+            Template.search([
+                    ('categories_all', 'child_of', [other.id], 'parent'),
+                    ]), [template])
+
+        Category.delete([other])
+        self.assertEqual(search([('parent', 'parent_of', [a1.id])]), {a, a1})
+        self.assertEqual(search([('parent', 'child_of', [a.id])]), {a, a1})
+
+    @with_transaction()
+    def test_category_complete_name(self):
+        "Test complete name of categories"
+        pool = Pool()
+        Category = pool.get('product.category')
+
+        root, = Category.create([{
+                    'name': "Root",
+                    'childs': [('create', [{
+                                    'name': "A",
+                                    'childs': [('create', [{
+                                                    'name': "A1",
+                                                    }])],
+                                    }])],
+                    }])
+        other, = Category.create([{'name': "Other"}])
+        a, = Category.search([('name', '=', "A")])
+        a1, = Category.search([('name', '=', "A1")])
+
+        self.assertEqual(a1.complete_name, "Root / A / A1")
+        self.assertEqual(a1.rec_name, "Root / A / A1")
+        self.assertEqual(
+            Category.search([('rec_name', '=', "Root /  A / A1 ")]), [a1])
+        self.assertEqual(
+            Category.search(
+                [('rec_name', 'ilike', "root / a%")],
+                order=[('id', 'ASC')]),
+            [a, a1])
+
+        Category.write([root], {'name': "Top"})
+        Category.write([a], {'parent': other.id})
+        self.assertEqual(a1.complete_name, "Other / A / A1")
+        self.assertEqual(
+            Category.search([('rec_name', 'ilike', "top%")]), [root])
+
+        with Transaction().set_context(language='fr'):
+            self.assertEqual(Category(a1.id).rec_name, "Other / A / A1")
+            self.assertEqual(
+                Category.search([('rec_name', '=', "Other / A / A1")]), [a1])
+
     def test_round_price(self):
         for value, result in [
                 (Decimal('1'), Decimal('1.0000')),
@@ -498,6 +1447,14 @@ class ProductTestCase(CompanyTestMixin, ModuleTestCase):
             with self.subTest(value=value):
                 self.assertEqual(round_price(value), result)
 
+    def test_round_prices(self):
+        values = [Decimal('1'), Decimal('1.12345'), Decimal('1.12355'), 1]
+        self.assertEqual(
+            round_prices(values), [round_price(v) for v in values])
+        self.assertEqual(
+            round_prices(values, rounding=ROUND_HALF_UP),
+            [round_price(v, rounding=ROUND_HALF_UP) for v in values])
+
     @with_transaction()
     def test_product_identifier_get_single_type(self):
         "Test identifier get with a single type"
@@ -585,5 +1542,162 @@ class ProductTestCase(CompanyTestMixin, ModuleTestCase):
 
         self.assertEqual(product.identifier_get('ean'), None)
 
+    @with_transaction()
+    def test_product_identifiers_get(self):
+        "Test identifiers get of many products"
+        pool = Pool()
+        Identifier = pool.get('product.identifier')
+        Product = pool.get('product.product')
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+
+        uom, = Uom.search([], limit=1)
+        template = Template(name="Product", default_uom=uom)
+        template.save()
+        product1 = Product(template=template, suffix_code="1")
+        product1.identifiers = [
+            Identifier(sequence=2, code='FOO'),
+            Identifier(sequence=1, type='ean', code='978-0-471-11709-4'),
+            Identifier(sequence=3, type='ean', code='4006381333931'),
+            ]
+        product1.save()
+        product2 = Product(template=template, suffix_code="2")
+        product2.save()
+        isbn, foo, ean = product1.identifiers
+
+        self.assertDictEqual(
+            Product.identifiers_get([product1, product2], 'ean'), {
+                product1.id: isbn,
+                product2.id: None,
+                })
+        self.assertDictEqual(
+            Product.identifiers_get([product1], {'isbn', None}), {
+                product1.id: foo,
+                })
+
+        Identifier.write([isbn], {'sequence': 4})
+        self.assertDictEqual(
+            Product.identifiers_get([product1], 'ean'), {
+                product1.id: ean,
+                })
+
+        Identifier.create([{'product': product2.id, 'code': 'BAR'}])
+        self.assertEqual(
+            Product.identifiers_get([product2], None)[product2.id].code,
+            'BAR')
+
+        Identifier.delete([ean])
+        self.assertDictEqual(
+            Product.identifiers_get([product1], 'ean'), {
+                product1.id: isbn,
+                })
+
+    @with_transaction()
+    def test_product_identifier_compact_code(self):
+        "Test identifier compact code"
+        pool = Pool()
+        Identifier = pool.get('product.identifier')
+        Product = pool.get('product.product')
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+
+        uom, = Uom.search([], limit=1)
+        template = Template(name="Product", default_uom=uom)
+        template.save()
+        product = Product(template=template)
+        product.identifiers = [
+            Identifier(code='FOO 1'),
+            Identifier(type='isbn', code='978-0-471-11709-4'),
+            ]
+        product.save()
+        foo, isbn = product.identifiers
+
+        self.assertEqual(foo.compact_code, 'FOO1')
+        self.assertEqual(isbn.compact_code, '9780471117094')
+
+        Identifier.write([isbn], {'code': '0-471-11709-9'})
+        self.assertEqual(isbn.compact_code, '0471117099')
+
+    @with_transaction()
+    def test_product_lookup_codes(self):
+        "Test lookup codes"
+        pool = Pool()
+        Identifier = pool.get('product.identifier')
+        Product = pool.get('product.product')
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+
+        uom, = Uom.search([], limit=1)
+        template = Template(name="Product", code="P", default_uom=uom)
+        template.save()
+        product1 = Product(template=template, suffix_code="1")
+        product1.identifiers = [
+            Identifier(type='ean', code='4006381333931'),
+            ]
+        product1.save()
+        product2 = Product(template=template, suffix_code="2")
+        product2.identifiers = [
+            Identifier(sequence=2, code='P1'),
+            Identifier(sequence=1, code='FOO'),
+            Identifier(sequence=3, code='BAR'),
+            ]
+        product2.save()
+        product2.identifiers += (
+            Identifier(sequence=4, type='isbn', code='020161622X'),)
+        product2.save()
+        product3 = Product(template=template, suffix_code="3", active=False)
+        product3.identifiers = [
+            Identifier(code='BAZ'),
+            ]
+        product3.save()
+
+        self.assertDictEqual(
+            Product.lookup_codes([
+                    'P1', 'P2', '4006381333931', '400-6381-333931',
+                    'FOO', 'BAZ', '020161622x', '0-201-61622-X',
+                    'UNKNOWN']), {
+                'P1': product1.id,
+                'P2': product2.id,
+                '4006381333931': product1.id,
+                '400-6381-333931': product1.id,
+                'FOO': product2.id,
+                '020161622x': product2.id,
+                '0-201-61622-X': product2.id,
+                })
+        with Transaction().set_context(active_test=False):
+            self.assertEqual(
+                Product.lookup_codes(['BAZ']), {'BAZ': product3.id})
+
+    @with_transaction()
+    def test_product_identifier_validate_codes(self):
+        "Test validate codes of identifiers"
+        pool = Pool()
+        Identifier = pool.get('product.identifier')
+        Product = pool.get('product.product')
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+
+        uom, = Uom.search([], limit=1)
+        template = Template(name="Product", default_uom=uom)
+        template.save()
+        product = Product(template=template)
+        product.save()
+
+        codes = ['4006381333931', '9780471117094', 'FOO', '4006381333932']
+        identifiers = [
+            Identifier(product=product, type='ean', code=c) for c in codes]
+        identifiers[2].type = None
+
+        Identifier.validate_codes(identifiers[:3])
+        with self.assertRaises(InvalidIdentifierCode):
+            Identifier.validate_codes(identifiers)
+        with self.assertRaises(InvalidIdentifierCode):
+            identifiers[3].pre_validate()
+
+        with patch.object(product_module, '_validation_chunk_size', 2):
+            Identifier.validate_codes(identifiers[:3], processes=2)
+            with self.assertRaises(InvalidIdentifierCode):
+                Identifier.validate_codes(identifiers, processes=2)
+
 
 del ModuleTestCase
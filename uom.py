@@ -1,14 +1,22 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 
+import operator
+from collections import defaultdict, deque, namedtuple
 from decimal import Decimal
-from math import ceil, floor, log10
+from functools import lru_cache
+from math import ceil, floor, gcd, log10
 
+from sql import Null
+from sql.conditionals import Case
+
+from trytond.cache import Cache
 from trytond.config import config
 from trytond.i18n import gettext
 from trytond.model import (
     Check, DeactivableMixin, DigitsMixin, ModelSQL, ModelView, SymbolMixin,
     fields)
+from trytond.pool import Pool
 from trytond.pyson import Eval
 from trytond.transaction import Transaction
 
@@ -25,6 +33,9 @@ class UomCategory(ModelSQL, ModelView):
     __name__ = 'product.uom.category'
     name = fields.Char('Name', required=True, translate=True)
     uoms = fields.One2Many('product.uom', 'category', "Units of Measure")
+    conversions = fields.One2Many(
+        'product.uom.category.conversion', 'from_category', "Conversions",
+        help="The ratios to convert the base unit to other categories.")
 
     @classmethod
     def __setup__(cls):
@@ -32,6 +43,156 @@ class UomCategory(ModelSQL, ModelView):
         cls._order.insert(0, ('name', 'ASC'))
 
 
+class UomCategoryConversion(ModelSQL, ModelView):
+    "Unit of Measure Category Conversion"
+    __name__ = 'product.uom.category.conversion'
+    from_category = fields.Many2One(
+        'product.uom.category', "From Category", required=True,
+        ondelete='CASCADE')
+    to_category = fields.Many2One(
+        'product.uom.category', "To Category", required=True,
+        ondelete='CASCADE',
+        domain=[
+            ('id', '!=', Eval('from_category', -1)),
+            ])
+    template = fields.Many2One(
+        'product.template', "Product", ondelete='CASCADE',
+        help="The product for which the conversion applies.\n"
+        "Leave empty for all products.")
+    rate = fields.Float(
+        "Rate", digits=uom_conversion_digits, required=True,
+        help="The coefficient for the formula:\n"
+        "1 (to base unit) = coef (from base unit)")
+    factor = fields.Float(
+        "Factor", digits=uom_conversion_digits, required=True,
+        help="The coefficient for the formula:\n"
+        "coefficient (to base unit) = 1 (from base unit)")
+    _factor_cache = Cache(
+        'product.uom.category.conversion.factor', context=False)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('non_zero_rate_factor', Check(t, (t.rate != 0) | (t.factor != 0)),
+                'product.msg_uom_no_zero_factor_rate')
+            ]
+
+    @staticmethod
+    def default_rate():
+        return 1.0
+
+    @staticmethod
+    def default_factor():
+        return 1.0
+
+    @fields.depends('factor')
+    def on_change_factor(self):
+        if (self.factor or 0.0) == 0.0:
+            self.rate = 0.0
+        else:
+            self.rate = round(1.0 / self.factor, uom_conversion_digits[1])
+
+    @fields.depends('rate')
+    def on_change_rate(self):
+        if (self.rate or 0.0) == 0.0:
+            self.factor = 0.0
+        else:
+            self.factor = round(
+                1.0 / self.rate, uom_conversion_digits[1])
+
+    @classmethod
+    def validate_fields(cls, conversions, field_names):
+        super().validate_fields(conversions, field_names)
+        cls.check_factor_and_rate(conversions, field_names)
+
+    @classmethod
+    def check_factor_and_rate(cls, conversions, field_names=None):
+        "Check coherence between factor and rate"
+        if field_names and not (field_names & {'rate', 'factor'}):
+            return
+        for conversion in conversions:
+            if conversion.rate == conversion.factor == 0.0:
+                continue
+            if (conversion.rate != round(
+                        1.0 / conversion.factor, uom_conversion_digits[1])
+                    and conversion.factor != round(
+                        1.0 / conversion.rate, uom_conversion_digits[1])):
+                message = (
+                    'product.msg_uom_category_conversion_'
+                    'incompatible_factor_rate')
+                raise UOMValidationError(
+                    gettext(message,
+                        from_category=conversion.from_category.rec_name,
+                        to_category=conversion.to_category.rec_name))
+
+    @classmethod
+    def create(cls, vlist):
+        conversions = super().create(vlist)
+        cls._factor_cache.clear()
+        return conversions
+
+    @classmethod
+    def write(cls, *args):
+        super().write(*args)
+        cls._factor_cache.clear()
+
+    @classmethod
+    def delete(cls, conversions):
+        super().delete(conversions)
+        cls._factor_cache.clear()
+
+    @classmethod
+    def get_factor(cls, from_category, to_category, template=None):
+        """
+        Return the factor and rate to convert between the base uom's of the
+        categories.
+
+        The conversions of the template take precedence over the global
+        conversions and they can be chained through other categories.
+        (None, None) is returned when no conversion is found.
+        """
+        from_category, to_category = int(from_category), int(to_category)
+        template_id = getattr(template, 'id', template)
+        key = (from_category, to_category, template_id)
+        result = cls._factor_cache.get(key)
+        if result is not None:
+            return result
+
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        where = table.template == Null
+        if template_id is not None and template_id >= 0:
+            where |= table.template == template_id
+        cursor.execute(*table.select(
+                table.from_category, table.to_category,
+                table.factor, table.rate, table.template,
+                where=where,
+                order_by=table.id))
+        edges = defaultdict(dict)
+        # The template conversions are last to override the global ones
+        for from_id, to_id, factor, rate, _ in sorted(
+                cursor, key=lambda r: r[-1] is not None):
+            edges[from_id][to_id] = (factor, rate)
+            edges[to_id][from_id] = (rate, factor)
+
+        # Breadth first search to find the shortest path
+        paths = {from_category: (1.0, 1.0)}
+        queue = deque([from_category])
+        while queue and to_category not in paths:
+            category = queue.popleft()
+            path_factor, path_rate = paths[category]
+            for next_category, (factor, rate) in edges[category].items():
+                if next_category not in paths:
+                    paths[next_category] = (
+                        path_factor * factor, path_rate * rate)
+                    queue.append(next_category)
+        result = paths.get(to_category, (None, None))
+        cls._factor_cache.set(key, result)
+        return result
+
+
 class Uom(SymbolMixin, DigitsMixin, DeactivableMixin, ModelSQL, ModelView):
     "Unit of Measure"
     __name__ = 'product.uom'
@@ -61,6 +222,7 @@ class Uom(SymbolMixin, DigitsMixin, DeactivableMixin, ModelSQL, ModelView):
     digits = fields.Integer(
         "Display Digits", required=True,
         help="The number of digits to display after the decimal separator.")
+    _conversion_cache = Cache('product.uom.conversion', context=False)
 
     @classmethod
     def __setup__(cls):
@@ -148,10 +310,17 @@ class Uom(SymbolMixin, DigitsMixin, DeactivableMixin, ModelSQL, ModelView):
                     gettext('product.msg_uom_incompatible_factor_rate',
                         uom=uom.rec_name))
 
+    @classmethod
+    def create(cls, vlist):
+        uoms = super().create(vlist)
+        cls._conversion_cache.clear()
+        return uoms
+
     @classmethod
     def write(cls, *args):
         if Transaction().user == 0:
             super(Uom, cls).write(*args)
+            cls._conversion_cache.clear()
             return
 
         all_uoms = sum(args[0:None:2], [])
@@ -160,6 +329,7 @@ class Uom(SymbolMixin, DigitsMixin, DeactivableMixin, ModelSQL, ModelView):
         old_digits = {uom.id: uom.digits for uom in all_uoms}
 
         super(Uom, cls).write(*args)
+        cls._conversion_cache.clear()
 
         for uom in all_uoms:
             for i, field in enumerate(['factor', 'rate', 'category']):
@@ -174,6 +344,11 @@ class Uom(SymbolMixin, DigitsMixin, DeactivableMixin, ModelSQL, ModelView):
                         uom=uom.rec_name),
                     gettext('product.msg_uom_modify_options'))
 
+    @classmethod
+    def delete(cls, uoms):
+        super().delete(uoms)
+        cls._conversion_cache.clear()
+
     @property
     def accurate_field(self):
         """
@@ -184,115 +359,326 @@ class Uom(SymbolMixin, DigitsMixin, DeactivableMixin, ModelSQL, ModelView):
 
     @classmethod
     def compute_qty(cls, from_uom, qty, to_uom, round=True,
-            factor=None, rate=None):
+            factor=None, rate=None, product=None, exact=False):
         """
         Convert quantity for given uom's.
 
+        The uom's can be instances or ids.
         When converting between uom's from different categories the factor and
         rate provide the ratio to use to convert between the category's base
-        uom's.
+        uom's. Without factor and rate, the ratio is found from the category
+        conversions of the product.
+        If exact is set, the conversion is computed with integer arithmetic
+        and the result is a Decimal for a Decimal quantity otherwise a float.
         """
         if not qty or (from_uom is None and to_uom is None):
             return qty
-        if from_uom is None:
-            raise ValueError("missing from_uom")
-        if to_uom is None:
-            raise ValueError("missing to_uom")
-        if from_uom.category.id != to_uom.category.id:
+        return cls._qty_converter(
+            from_uom, to_uom, round=round, factor=factor, rate=rate,
+            product=product, exact=exact)(qty)
+
+    @classmethod
+    def compute_qty_many(
+            cls, from_uoms, quantities, to_uoms, round=True, products=None,
+            exact=False):
+        """
+        Convert the quantities for the given lists of uom's.
+
+        The result is the same as calling compute_qty for each quantity but
+        the conversion between each pair of uom's is computed only once.
+        The optional list of products is used for the conversions between
+        different categories.
+        """
+        def get_converter(from_uom, to_uom, product):
+            return cls._qty_converter(
+                from_uom, to_uom, round=round, product=product, exact=exact)
+        return cls._convert_many(
+            get_converter, from_uoms, quantities, to_uoms, products)
+
+    @classmethod
+    def _convert_many(cls, get_converter, from_uoms, values, to_uoms,
+            products=None):
+        if products is None:
+            products = [None] * len(values)
+        if not (len(from_uoms) == len(values) == len(to_uoms)
+                == len(products)):
+            raise ValueError("from_uoms, values, to_uoms and products must "
+                "have the same length")
+        converters = {}
+        # pairs of uom's from different categories depend on the product
+        product_pairs = set()
+        result = []
+        for from_uom, value, to_uom, product in zip(
+                from_uoms, values, to_uoms, products):
+            if not value or (from_uom is None and to_uom is None):
+                result.append(value)
+                continue
+            key = (from_uom, to_uom)
+            if key in product_pairs:
+                key = (from_uom, to_uom, product)
+            try:
+                converter = converters[key]
+            except KeyError:
+                if (from_uom is not None and to_uom is not None
+                        and cls._get_data(from_uom).category
+                        != cls._get_data(to_uom).category):
+                    product_pairs.add(key)
+                    key = (from_uom, to_uom, product)
+                converter = converters[key] = get_converter(
+                    from_uom, to_uom, product)
+            result.append(converter(value))
+        return result
+
+    @classmethod
+    def compute_qty_sql(cls, quantity, from_uom, to_uom):
+        """
+        Return a SQL expression converting the quantity expression from the
+        uom column to to_uom.
+
+        Only the uom's of the same category as to_uom are converted, the
+        others give NULL. The result is not rounded.
+        """
+        registry = cls._get_registry()
+        to_data = cls._get_data(to_uom, registry)
+        to_op, to_value = to_data.qty_to
+        quantity = cls.factor.sql_cast(quantity)
+        whens = []
+        for uom_id in registry.categories.get(to_data.category, []):
+            from_op, from_value = registry.uoms[uom_id].qty_from
+            whens.append((
+                    from_uom == uom_id,
+                    to_op(from_op(quantity, from_value), to_value)))
+        return Case(*whens)
+
+    @classmethod
+    def _check_categories(cls, from_data, to_data, factor, rate, product):
+        "Return the factor and rate to use between the categories"
+        pool = Pool()
+        Category = pool.get('product.uom.category')
+        Conversion = pool.get('product.uom.category.conversion')
+        if from_data.category != to_data.category:
+            if not factor and not rate:
+                if product and product.__name__ == 'product.product':
+                    product = product.template
+                factor, rate = Conversion.get_factor(
+                    from_data.category, to_data.category, template=product)
             if not factor and not rate:
                 raise ValueError(
                     "cannot convert between %s and %s without a factor or rate"
-                    % (from_uom.category.name, to_uom.category.name))
+                    % (Category(from_data.category).name,
+                        Category(to_data.category).name))
         elif factor or rate:
             raise ValueError("factor and rate not allowed for same category")
-
-        if from_uom.accurate_field == 'factor':
-            amount = qty * from_uom.factor
-        else:
-            amount = qty / from_uom.rate
-
         if factor and rate:
             if _accurate_operator(factor, rate) == 'rate':
                 factor = None
             else:
                 rate = None
+        return factor, rate
+
+    @classmethod
+    def _qty_converter(cls, from_uom, to_uom, round=True,
+            factor=None, rate=None, product=None, exact=False):
+        "Return a function which converts quantity from_uom to to_uom"
+        if from_uom is None:
+            raise ValueError("missing from_uom")
+        if to_uom is None:
+            raise ValueError("missing to_uom")
+        registry = cls._get_registry()
+        from_data = cls._get_data(from_uom, registry)
+        to_data = cls._get_data(to_uom, registry)
+        factor, rate = cls._check_categories(
+            from_data, to_data, factor, rate, product)
+        if exact:
+            return cls._exact_qty_converter(
+                from_data, to_data, round=round, factor=factor, rate=rate)
+
+        from_op, from_value = from_data.qty_from
         if factor:
-            amount *= factor
+            category_op, category_value = operator.mul, factor
         elif rate:
-            amount /= rate
-
-        if to_uom.accurate_field == 'factor':
-            amount = amount / to_uom.factor
+            category_op, category_value = operator.truediv, rate
         else:
-            amount = amount * to_uom.rate
+            category_op = category_value = None
+        to_op, to_value = to_data.qty_to
+        precision, rounding_factor = to_data.precision, to_data.rounding_factor
+
+        def convert(qty):
+            amount = from_op(qty, from_value)
+            if category_op:
+                amount = category_op(amount, category_value)
+            amount = to_op(amount, to_value)
+            if round:
+                amount = _round_factor(amount, precision, rounding_factor)
+            return amount
+        return convert
 
+    @classmethod
+    def _exact_qty_converter(cls, from_data, to_data, round=True,
+            factor=None, rate=None):
+        "Return a function which converts quantity using integer arithmetic"
+        numerator = from_data.ratio[0] * to_data.ratio[1]
+        denominator = from_data.ratio[1] * to_data.ratio[0]
+        if factor:
+            factor = _integer_ratio(factor)
+            numerator *= factor[0]
+            denominator *= factor[1]
+        elif rate:
+            rate = _integer_ratio(rate)
+            numerator *= rate[1]
+            denominator *= rate[0]
+        precision_numerator, precision_denominator = to_data.rounding_ratio
         if round:
-            amount = to_uom.round(amount)
+            # Convert directly into a number of rounding precision
+            numerator *= precision_denominator
+            denominator *= precision_numerator
+        divisor = gcd(numerator, denominator)
+        numerator //= divisor
+        denominator //= divisor
+
+        def convert(qty):
+            qty_numerator, qty_denominator = _integer_ratio(qty)
+            amount_numerator = qty_numerator * numerator
+            amount_denominator = qty_denominator * denominator
+            if round:
+                amount_numerator = _round_integer(
+                    amount_numerator, amount_denominator
+                    ) * precision_numerator
+                amount_denominator = precision_denominator
+            if isinstance(qty, Decimal):
+                return Decimal(amount_numerator) / amount_denominator
+            return amount_numerator / amount_denominator
+        return convert
 
-        return amount
+    @classmethod
+    def _get_registry(cls):
+        "Return the snapshot of all the uom's"
+        registry = cls._conversion_cache.get(None)
+        if registry is None:
+            table = cls.__table__()
+            cursor = Transaction().connection.cursor()
+            cursor.execute(*table.select(
+                    table.id, table.category,
+                    table.factor, table.rate, table.rounding,
+                    order_by=table.id))
+            registry = _UomRegistry(cursor)
+            cls._conversion_cache.set(None, registry)
+        return registry
+
+    @classmethod
+    def _get_data(cls, uom, registry=None):
+        """Return the snapshot data of the uom instance or id
+
+        The values of unsaved instances or of instances with modified
+        conversion fields are used instead of the snapshot."""
+        if not isinstance(uom, int) and (
+                uom.id is None or uom.id < 0
+                or (uom._values
+                    and not {'category', 'factor', 'rate', 'rounding'}
+                    .isdisjoint(uom._values._keys()))):
+            return _UomData.new(
+                uom.id, uom.category.id, uom.factor, uom.rate, uom.rounding)
+        if registry is None:
+            registry = cls._get_registry()
+        try:
+            return registry.uoms[int(uom)]
+        except KeyError:
+            # The uom may have been created after the snapshot,
+            # the read raises an error if it does not exist
+            uom = cls(int(uom))
+            return _UomData.new(
+                uom.id, uom.category.id, uom.factor, uom.rate, uom.rounding)
 
     @classmethod
-    def compute_price(cls, from_uom, price, to_uom, factor=None, rate=None):
+    def compute_price(cls, from_uom, price, to_uom, factor=None, rate=None,
+            product=None):
         """
         Convert price for given uom's.
 
+        The uom's can be instances or ids.
         When converting between uom's from different categories the factor and
         rate provide the ratio to use to convert between the category's base
-        uom's.
+        uom's. Without factor and rate, the ratio is found from the category
+        conversions of the product.
         """
         if not price or (from_uom is None and to_uom is None):
             return price
+        return cls._price_converter(
+            from_uom, to_uom, factor=factor, rate=rate, product=product)(price)
+
+    @classmethod
+    def compute_price_many(cls, from_uoms, prices, to_uoms, products=None):
+        """
+        Convert the prices for the given lists of uom's.
+
+        The result is the same as calling compute_price for each price but
+        the conversion between each pair of uom's is computed only once.
+        The optional list of products is used for the conversions between
+        different categories.
+        """
+        def get_converter(from_uom, to_uom, product):
+            return cls._price_converter(from_uom, to_uom, product=product)
+        return cls._convert_many(
+            get_converter, from_uoms, prices, to_uoms, products)
+
+    @classmethod
+    def _price_converter(cls, from_uom, to_uom, factor=None, rate=None,
+            product=None):
+        "Return a function which converts price from_uom to to_uom"
         if from_uom is None:
             raise ValueError("missing from_uom")
         if to_uom is None:
             raise ValueError("missing to_uom")
-        if from_uom.category.id != to_uom.category.id:
-            if not factor and not rate:
-                raise ValueError(
-                    "cannot convert between %s and %s without a factor or rate"
-                    % (from_uom.category.name, to_uom.category.name))
-        elif factor or rate:
-            raise ValueError("factor and rate not allow for same category")
-
-        format_ = '%%.%df' % uom_conversion_digits[1]
+        registry = cls._get_registry()
+        from_data = cls._get_data(from_uom, registry)
+        to_data = cls._get_data(to_uom, registry)
+        factor, rate = cls._check_categories(
+            from_data, to_data, factor, rate, product)
 
-        if from_uom.accurate_field == 'factor':
-            new_price = price / Decimal(format_ % from_uom.factor)
-        else:
-            new_price = price * Decimal(format_ % from_uom.rate)
-
-        if factor and rate:
-            if _accurate_operator(factor, rate) == 'rate':
-                factor = None
-            else:
-                rate = None
+        from_op, from_value = from_data.price_from
         if factor:
-            new_price /= Decimal(factor)
+            category_op, category_value = operator.truediv, Decimal(factor)
         elif rate:
-            new_price *= Decimal(rate)
-
-        if to_uom.accurate_field == 'factor':
-            new_price = new_price * Decimal(format_ % to_uom.factor)
+            category_op, category_value = operator.mul, Decimal(rate)
         else:
-            new_price = new_price / Decimal(format_ % to_uom.rate)
+            category_op = category_value = None
+        to_op, to_value = to_data.price_to
 
-        return new_price
+        def convert(price):
+            new_price = from_op(price, from_value)
+            if category_op:
+                new_price = category_op(new_price, category_value)
+            return to_op(new_price, to_value)
+        return convert
 
 
 def _round(uom, number, func=round):
     if not number:
         # Avoid unnecessary computation
         return number
-    precision = uom.rounding
+    precision, factor = _rounding_factor(uom.rounding)
+    return _round_factor(number, precision, factor, func=func)
+
+
+@lru_cache(maxsize=1024)
+def _rounding_factor(precision):
     # Convert precision into an integer greater than 1 to avoid precision lost.
     # This works for most cases because rounding is often: n * 10**i
     if precision < 1:
         exp = -floor(log10(precision))
         factor = 10 ** exp
-        number *= factor
         precision *= factor
     else:
         factor = 1
+    return precision, factor
+
+
+def _round_factor(number, precision, factor, func=round):
+    if not number:
+        # Avoid unnecessary computation
+        return number
+    if factor != 1:
+        number *= factor
     # Divide by factor which is an integer to avoid precision lost due to
     # multiplication by float < 1.
     # example:
@@ -303,6 +689,26 @@ def _round(uom, number, func=round):
     return func(number / precision) * precision / factor
 
 
+def _integer_ratio(value):
+    "Return the exact ratio of integers of the value"
+    if isinstance(value, int):
+        return value, 1
+    if isinstance(value, float):
+        # Use the shortest representation which is the intended value
+        value = Decimal(repr(value))
+    return value.as_integer_ratio()
+
+
+def _round_integer(numerator, denominator):
+    "Round half to even the ratio of integers"
+    quotient, remainder = divmod(numerator, denominator)
+    if (2 * remainder > denominator
+            or (2 * remainder == denominator and quotient % 2)):
+        quotient += 1
+    return quotient
+
+
+@lru_cache(maxsize=1024)
 def _accurate_operator(factor, rate):
     lengths = {}
     for name, value in [('rate', rate), ('factor', factor)]:
@@ -316,3 +722,52 @@ def _accurate_operator(factor, rate):
         return 'factor'
     else:
         return 'rate'
+
+
+class _UomData(namedtuple('_UomData', [
+                'id', 'category', 'operator', 'precision', 'rounding_factor',
+                'qty_from', 'qty_to', 'price_from', 'price_to',
+                'ratio', 'rounding_ratio'])):
+    "The immutable conversion data of a unit of measure"
+    __slots__ = ()
+
+    @classmethod
+    def new(cls, id_, category, factor, rate, rounding):
+        format_ = '%%.%df' % uom_conversion_digits[1]
+        precision, rounding_factor = _rounding_factor(rounding)
+        rounding_ratio = _integer_ratio(rounding)
+        if _accurate_operator(factor, rate) == 'factor':
+            decimal = Decimal(format_ % factor)
+            return cls(id_, category, 'factor', precision, rounding_factor,
+                qty_from=(operator.mul, factor),
+                qty_to=(operator.truediv, factor),
+                price_from=(operator.truediv, decimal),
+                price_to=(operator.mul, decimal),
+                ratio=decimal.as_integer_ratio(),
+                rounding_ratio=rounding_ratio)
+        else:
+            decimal = Decimal(format_ % rate)
+            return cls(id_, category, 'rate', precision, rounding_factor,
+                qty_from=(operator.truediv, rate),
+                qty_to=(operator.mul, rate),
+                price_from=(operator.mul, decimal),
+                price_to=(operator.truediv, decimal),
+                ratio=decimal.as_integer_ratio()[::-1],
+                rounding_ratio=rounding_ratio)
+
+
+class _UomRegistry(object):
+    "The snapshot of the conversion data of all the units of measure"
+    __slots__ = ('uoms', 'categories')
+
+    def __init__(self, uoms):
+        self.uoms = {}
+        self.categories = defaultdict(list)
+        for id_, category, factor, rate, rounding in uoms:
+            self.uoms[id_] = _UomData.new(
+                id_, category, factor, rate, rounding)
+            self.categories[category].append(id_)
+
+    def __deepcopy__(self, memo):
+        # The instances are never modified once created so they can be shared
+        return self